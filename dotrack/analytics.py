@@ -0,0 +1,385 @@
+"""Columnar snapshot of the event history for vectorized analysis.
+
+Event and ExpEvent rows are materialized into one .npy file per column
+below data/analytics, which are opened memory mapped. Times are stored
+as int64 microseconds since the epoch, treating the stored local times
+as UTC, so that days start at a multiple of DAY. A missing todo is
+stored as -1.
+
+refresh() only appends rows with an id larger than the last snapshotted
+one. Edits of existing rows are not picked up by that; the snapshot is
+rebuilt if the last snapshotted row changed or rows were removed, and
+rebuild() can be used after editing older events.
+
+Requires numpy.
+"""
+
+import datetime
+import io
+
+import numpy as np
+import peewee
+
+from dotrack.model import db, Event, EventType, ExpEvent
+from dotrack.shared import DATA_DIR
+
+SNAPSHOT_DIR = DATA_DIR / 'analytics'
+
+SECOND = 1000000
+HOUR = 3600 * SECOND
+DAY = 24 * HOUR
+
+CHUNK_SIZE = 100000
+
+
+def epoch_us(field):
+    """SQL expression of a DateTimeField as microseconds since the epoch."""
+    seconds = peewee.Cast(peewee.fn.strftime('%s', field), 'INTEGER')
+    # peewee stores the microseconds only if they are not zero
+    micro = peewee.Cast(
+        peewee.fn.substr(field.concat('.000000'), 21, 6), 'INTEGER')
+    return seconds * SECOND + micro
+
+
+def to_us(time):
+    if time is None:
+        return None
+    epoch = datetime.datetime(1970, 1, 1)
+    return (time - epoch) // datetime.timedelta(microseconds=1)
+
+
+def read_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return version, np.lib.format.read_array_header_1_0(f)
+    else:
+        return version, np.lib.format.read_array_header_2_0(f)
+
+
+def header_bytes(version, shape, fortran_order, dtype):
+    header = io.BytesIO()
+    data = {
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': fortran_order,
+        'shape': shape,
+    }
+    if version == (1, 0):
+        np.lib.format.write_array_header_1_0(header, data)
+    else:
+        np.lib.format.write_array_header_2_0(header, data)
+    return header.getvalue()
+
+
+def append_npy(path, values):
+    """Append values to the one dimensional array stored at path."""
+    if not path.exists():
+        np.save(path, values)
+        return
+
+    with open(path, 'r+b') as f:
+        version, (shape, fortran_order, dtype) = read_header(f)
+        data_offset = f.tell()
+        header = header_bytes(version, (shape[0] + len(values),),
+                              fortran_order, dtype)
+
+        # the header is padded, so it only changes size in rare cases
+        if len(header) == data_offset:
+            # data first, so that an interrupted append leaves the old
+            # shape in the header
+            f.seek(data_offset + shape[0] * dtype.itemsize)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+            f.truncate()
+            f.seek(0)
+            f.write(header)
+            return
+
+    np.save(path, np.concatenate([np.load(path), values.astype(dtype)]))
+
+
+class Snapshot:
+    """Columns of one table, ordered by the primary key in column id."""
+
+    def __init__(self, name, query, columns):
+        self.path = SNAPSHOT_DIR / name
+        self.query = query
+        self.columns = columns
+        self.data = None
+        self.truncated = False
+
+    def column_path(self, name):
+        return self.path / f'{name}.npy'
+
+    def load(self):
+        data = dict()
+        for name in self.columns:
+            path = self.column_path(name)
+            if not path.exists():
+                data = None
+                break
+            data[name] = np.load(path, mmap_mode='r')
+
+        if data is None:
+            data = {name: np.empty(0, dtype=dtype)
+                    for name, dtype in self.columns.items()}
+
+        # an interrupted append may leave columns of different length
+        length = min(len(column) for column in data.values())
+        self.truncated = any(len(column) != length
+                             for column in data.values())
+        self.data = {name: column[:length] for name, column in data.items()}
+
+    def __len__(self):
+        return len(self.data['id'])
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def last_id(self):
+        return int(self['id'][-1]) if len(self) else 0
+
+    def is_valid(self):
+        """Cheap check that the snapshotted rows were not changed."""
+        if not len(self):
+            return True
+
+        model = self.query.model
+        id_field = self.query.id_field
+        count = (model
+                 .select(peewee.fn.COUNT(id_field))
+                 .where(id_field <= self.last_id())
+                 .scalar())
+        last_time = (model
+                     .select(epoch_us(self.query.time_field))
+                     .where(id_field == self.last_id())
+                     .scalar())
+        return count == len(self) and last_time == self['time'][-1]
+
+    def rebuild(self):
+        for name in self.columns:
+            self.column_path(name).unlink(missing_ok=True)
+        self.load()
+        self.refresh()
+
+    def refresh(self):
+        """Append the rows added since the last refresh."""
+        if self.data is None:
+            self.load()
+
+        if not self.is_valid():
+            self.rebuild()
+            return
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        if self.truncated:
+            for name in self.columns:
+                path = self.column_path(name)
+                if len(self):
+                    np.save(path, np.array(self[name]))
+                else:
+                    path.unlink(missing_ok=True)
+
+        cursor = db().execute(self.query.since(self.last_id()))
+        added = False
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+
+            table = np.array(rows, dtype=np.int64)
+            for i, (name, dtype) in enumerate(self.columns.items()):
+                append_npy(self.column_path(name), table[:, i].astype(dtype))
+            added = True
+
+        if added or self.truncated:
+            self.load()
+
+
+class SnapshotQuery:
+    def __init__(self, model, id_field, time_field, *fields):
+        self.model = model
+        self.id_field = id_field
+        self.time_field = time_field
+        self.fields = fields
+
+    def since(self, last_id):
+        return (self.model
+                .select(self.id_field, epoch_us(self.time_field),
+                        *self.fields)
+                .where(self.id_field > last_id)
+                .order_by(self.id_field))
+
+
+def event_snapshot():
+    return Snapshot(
+        'event',
+        SnapshotQuery(Event, Event.event_id, Event.time,
+                      peewee.fn.COALESCE(Event.todo, -1), Event.event_type),
+        {'id': np.int64, 'time': np.int64, 'todo': np.int32,
+         'type': np.int32})
+
+
+def exp_event_snapshot():
+    return Snapshot(
+        'exp_event',
+        SnapshotQuery(ExpEvent, ExpEvent.exp_event_id, ExpEvent.time,
+                      peewee.fn.COALESCE(ExpEvent.todo, -1),
+                      ExpEvent.event_type, ExpEvent.exp),
+        {'id': np.int64, 'time': np.int64, 'todo': np.int32,
+         'type': np.int32, 'exp': np.int32})
+
+
+def clip(start, end, begin=None, until=None):
+    """Clip intervals to begin and until, dropping empty ones."""
+    if begin is not None:
+        start = np.maximum(start, to_us(begin))
+    if until is not None:
+        end = np.minimum(end, to_us(until))
+    keep = start < end
+    return start[keep], end[keep], keep
+
+
+def bucket_totals(start, end, width):
+    """Sum of the intervals per bucket of width, split at bucket borders.
+
+    Returns (first bucket, totals), where totals[i] is the time in bucket
+    first + i.
+    """
+    if not len(start):
+        return 0, np.zeros(0, dtype=np.int64)
+
+    first_bucket = start // width
+    last_bucket = (end - 1) // width
+    offset = first_bucket.min()
+    size = last_bucket.max() - offset + 1
+    first_bucket -= offset
+    last_bucket -= offset
+
+    totals = np.zeros(size, dtype=np.int64)
+    same = first_bucket == last_bucket
+    np.add.at(totals, first_bucket[same], (end - start)[same])
+
+    multi = ~same
+    lo, hi = first_bucket[multi], last_bucket[multi]
+    np.add.at(totals, lo, (lo + offset + 1) * width - start[multi])
+    np.add.at(totals, hi, end[multi] - (hi + offset) * width)
+
+    # full buckets in between, with a difference array
+    full = np.zeros(size + 1, dtype=np.int64)
+    np.add.at(full, lo + 1, 1)
+    np.add.at(full, hi, -1)
+    totals += np.cumsum(full[:-1]) * width
+
+    return offset, totals
+
+
+class History:
+    """Vectorized analysis over the snapshots.
+
+    Intervals are returned as int64 microseconds since the epoch, use
+    .view('datetime64[us]') to convert.
+    """
+
+    def __init__(self, events, exp_events):
+        self.events = events
+        self.exp_events = exp_events
+
+    @classmethod
+    def load(cls, refresh=True):
+        events = event_snapshot()
+        exp_events = exp_event_snapshot()
+        if refresh:
+            events.refresh()
+            exp_events.refresh()
+        else:
+            events.load()
+            exp_events.load()
+        return cls(events, exp_events)
+
+    def sessions(self, begin=None, until=None, now=None):
+        """Arrays (todo, start, end) of the work sessions.
+
+        Follows iter_sessions: a START lasts until the next START or STOP,
+        a STOP without START is ignored and the last START lasts until now.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+
+        start_type = EventType.START.event_type_id
+        stop_type = EventType.STOP.event_type_id
+
+        types = self.events['type']
+        marks = np.flatnonzero((types == start_type) | (types == stop_type))
+        times = self.events['time'][marks]
+        # edited events may be out of order, the id breaks ties like in SQL
+        order = np.lexsort((self.events['id'][marks], times))
+        marks, times = marks[order], times[order]
+
+        is_start = self.events['type'][marks] == start_type
+        following = np.append(times[1:], to_us(now))
+
+        todo = self.events['todo'][marks][is_start]
+        start = times[is_start]
+        end = np.maximum(following[is_start], start)
+
+        start, end, keep = clip(start, end, begin, until)
+        return todo[keep], start, end
+
+    def durations(self, begin=None, until=None, now=None):
+        """Session lengths in seconds."""
+        todo, start, end = self.sessions(begin, until, now)
+        return (end - start) / SECOND
+
+    def session_percentiles(self, q=(50, 90, 99), begin=None, until=None):
+        durations = self.durations(begin, until)
+        if not len(durations):
+            return np.full(len(q), np.nan)
+        return np.percentile(durations, q)
+
+    def per_day(self, begin=None, until=None):
+        """Arrays (days as datetime64[D], seconds) of days with work."""
+        todo, start, end = self.sessions(begin, until)
+        offset, totals = bucket_totals(start, end, DAY)
+        days = np.flatnonzero(totals)
+        return ((days + offset).astype('datetime64[D]'),
+                totals[days] / SECOND)
+
+    def per_todo(self, begin=None, until=None):
+        """Arrays (todo ids, seconds) of todos with work."""
+        todo, start, end = self.sessions(begin, until)
+        known = todo >= 0
+        todo, start, end = todo[known], start[known], end[known]
+        if not len(todo):
+            return todo, np.zeros(0)
+        totals = np.bincount(todo, weights=(end - start) / SECOND)
+        todos = np.flatnonzero(totals)
+        return todos, totals[todos]
+
+    def hour_of_week(self, begin=None, until=None):
+        """Seconds of work per weekday (monday first) and hour, 7 x 24."""
+        todo, start, end = self.sessions(begin, until)
+        offset, totals = bucket_totals(start, end, HOUR)
+        # the epoch was a thursday
+        hours = (np.arange(len(totals)) + offset + 3 * 24) % (7 * 24)
+        heatmap = np.bincount(hours, weights=totals / SECOND,
+                              minlength=7 * 24)
+        return heatmap.reshape(7, 24)
+
+    def exp_per_day(self, begin=None, until=None):
+        """Arrays (days as datetime64[D], exp) of days with exp events."""
+        time = self.exp_events['time']
+        keep = np.ones(len(time), dtype=bool)
+        if begin is not None:
+            keep &= time >= to_us(begin)
+        if until is not None:
+            keep &= time < to_us(until)
+
+        days = time[keep] // DAY
+        if not len(days):
+            return days.astype('datetime64[D]'), np.zeros(0, np.int64)
+
+        offset = days.min()
+        totals = np.bincount(days - offset,
+                             weights=self.exp_events['exp'][keep])
+        nonzero = np.flatnonzero(totals)
+        return ((nonzero + offset).astype('datetime64[D]'),
+                totals[nonzero].astype(np.int64))
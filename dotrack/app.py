@@ -0,0 +1,773 @@
+from guiml.components import Component, Div, UIComponent
+from guiml.core import run
+
+from dataclasses import astuple, dataclass, field
+
+
+from guiml.injectables import (Injectable, injectable, Observable,
+                               Subscriber, UILoop)
+
+
+from guiml.components import Container
+
+from dotrack import icon  # noqa: F401
+from dotrack import timer  # noqa: F401
+from dotrack.model import TodoService
+import dotrack.model as model
+from typing import Callable, Optional
+
+from dotrack.config import Config
+from dotrack.querymonitor import QueryMonitor
+from dotrack.shared import component, res, BASE_DIR, DATA_DIR
+from dotrack.startup import startup
+
+import cairocffi as cairo
+import datetime
+import json
+import math
+import time
+
+import pyglet
+from pyglet import clock
+
+
+@component("application")
+class Application(Component):
+    pass
+
+
+def run_app():
+    # windows are drawn by the FrameScheduler
+    run(
+        global_style=res.style_file("styles.yml", "global"),
+        interval=None
+    )
+
+
+@Config.register
+@dataclass
+class FrameSchedulerSettings:
+    active_interval: float = 1 / 30
+    """Update interval while the user interacts with dotrack."""
+
+    active_duration: float = 2.
+    """Seconds to keep the active interval after the last input."""
+
+    timer_interval: float = 1.
+    """Update interval while only the pomodoro timer is running."""
+
+    idle_interval: Optional[float] = None
+    """Update interval when nothing changes, None to stop updating."""
+
+
+@injectable("application")
+class FrameScheduler(Injectable, Subscriber):
+    """Adapts the update interval of the UI to what can change on screen.
+
+    Updates run at the active interval for a while after any input or
+    notification from the services, at the timer interval while the
+    pomodoro timer runs and stop otherwise.
+    """
+
+    INPUT_EVENTS = [
+        "on_mouse_motion",
+        "on_mouse_press",
+        "on_mouse_release",
+        "on_mouse_drag",
+        "on_mouse_enter",
+        "on_mouse_leave",
+        "on_mouse_scroll",
+        "on_key_press",
+        "on_key_release",
+        "on_text",
+        "on_text_motion",
+        "on_text_motion_select",
+        "on_resize",
+        "on_expose",
+        "on_activate",
+    ]
+
+    @dataclass
+    class Dependencies(Injectable.Dependencies):
+        ui_loop: UILoop
+        config: Config
+        todo_service: TodoService
+        timer: model.Timer
+
+    def on_init(self):
+        self.settings = self.config[FrameSchedulerSettings]
+        self.windows = set()
+        self.interval = None
+        self.last_wake = time.monotonic()
+
+        self.on_frame_begin = Observable()
+        self.on_frame_end = Observable()
+
+        self.subscribe('on_selected_changed', self.todo_service, self.wake)
+        self.subscribe('on_todo_toggle', self.todo_service, self.wake)
+        self.subscribe('on_todos_changed', self.todo_service, self.wake)
+        self.subscribe('on_changed', model.db.changes, self.wake)
+        # checked once per frame, nothing is polled while the UI is idle
+        self.subscribe('on_frame_begin', self, model.db.changes.poll)
+        self.subscribe('on_reset', self.timer, self.wake)
+
+        # The UILoop schedules its updates itself at a fixed rate and changes
+        # it when the window is (de)activated, take over the scheduling.
+        clock.unschedule(self.ui_loop._update)
+        self.ui_loop.set_active_update_rate = self.wake
+        self.ui_loop.set_inactive_update_rate = self.reschedule
+
+        self.schedule(self.settings.active_interval, delay=0)
+
+    def on_destroy(self):
+        self.cancel_subscriptions()
+        clock.unschedule(self.tick)
+
+    def wake(self, *args, **kwargs):
+        self.last_wake = time.monotonic()
+        if self.interval != self.settings.active_interval:
+            self.schedule(self.settings.active_interval, delay=0)
+
+    def current_interval(self):
+        settings = self.settings
+        if time.monotonic() - self.last_wake < settings.active_duration:
+            return settings.active_interval
+        elif self.timer.is_running():
+            return settings.timer_interval
+        else:
+            return settings.idle_interval
+
+    def schedule(self, interval, delay=None):
+        clock.unschedule(self.tick)
+        self.interval = interval
+        if interval is not None:
+            if delay is None:
+                delay = interval
+            clock.schedule_once(self.tick, delay)
+
+    def reschedule(self):
+        self.schedule(self.current_interval())
+
+    def watch_windows(self):
+        for window in pyglet.app.windows:
+            if window not in self.windows:
+                self.windows.add(window)
+                window.push_handlers(
+                    **{event: self.wake for event in self.INPUT_EVENTS})
+
+    def tick(self, dt):
+        self.on_frame_begin()
+        self.ui_loop._update(dt)
+        self.watch_windows()
+        for window in pyglet.app.windows:
+            window.draw(dt)
+        self.on_frame_end()
+
+        self.reschedule()
+
+
+@Config.register
+@dataclass
+class QueryMonitorSettings:
+    enabled: bool = False
+    """Count the SQL statements per frame and caller."""
+
+    overlay: bool = False
+    """Show the statements of the last frame in the window."""
+
+    budget: Optional[int] = 20
+    """Statements per frame before a warning is printed, None for no
+    limit."""
+
+    dump_interval: Optional[float] = None
+    """Seconds between reports of the totals, None for no reports."""
+
+    dump_file: Optional[str] = None
+    """File in the data directory the reports are appended to as JSON
+    lines, None to print them."""
+
+
+@injectable("application")
+class QueryMonitorService(Injectable, Subscriber):
+    """Attaches a QueryMonitor to the database if enabled."""
+
+    WARN_INTERVAL = 10.
+    OVERLAY_CALLERS = 5
+
+    @dataclass
+    class Dependencies(Injectable.Dependencies):
+        config: Config
+        frame_scheduler: FrameScheduler
+
+    def on_init(self):
+        self.settings = self.config[QueryMonitorSettings]
+        self.monitor = None
+        if not self.settings.enabled:
+            return
+
+        self.monitor = QueryMonitor()
+        model.db().monitor = self.monitor
+        self.last_warning = None
+        self.windows = set()
+        self.label = None
+
+        self.subscribe('on_frame_begin', self.frame_scheduler,
+                       self.monitor.begin_frame)
+        self.subscribe('on_frame_end', self.frame_scheduler, self.on_frame_end)
+
+        if self.settings.dump_interval is not None:
+            clock.schedule_interval(self.dump, self.settings.dump_interval)
+
+    def on_destroy(self):
+        if self.monitor is None:
+            return
+
+        self.cancel_subscriptions()
+        clock.unschedule(self.dump)
+        if self.settings.dump_interval is not None:
+            self.dump()
+        model.db().monitor = None
+
+    def on_frame_end(self):
+        frame = self.monitor.end_frame(self.settings.budget)
+
+        budget = self.settings.budget
+        if budget is not None and frame.statements > budget:
+            now = time.monotonic()
+            if (self.last_warning is None
+                    or now - self.last_warning > self.WARN_INTERVAL):
+                self.last_warning = now
+                callers = ', '.join(
+                    f'{name} ({stats.statements})'
+                    for name, stats in frame.top(3))
+                print(f'query budget exceeded: {frame.statements} '
+                      f'statements in a frame, budget is {budget}, '
+                      f'from {callers}')
+
+        if self.settings.overlay:
+            self.watch_windows()
+
+    def watch_windows(self):
+        # on_refresh is dispatched after on_draw, so the overlay is drawn
+        # on top of the window content
+        for window in pyglet.app.windows:
+            if window not in self.windows:
+                self.windows.add(window)
+                window.push_handlers(on_refresh=self.draw_overlay)
+
+    def overlay_text(self):
+        frame = self.monitor.last_frame
+        lines = [f'{frame.statements} sql, {frame.rows} rows, '
+                 f'{frame.seconds * 1000:.1f} ms']
+        for name, stats in frame.top(self.OVERLAY_CALLERS):
+            lines.append(f'{stats.statements:3} {name}')
+        return '\n'.join(lines)
+
+    def draw_overlay(self, dt):
+        if self.label is None:
+            self.label = pyglet.text.Label(
+                '', x=10, y=40, width=600, multiline=True,
+                font_size=9, color=(0, 0, 0, 255), anchor_y='bottom')
+
+        self.label.text = self.overlay_text()
+        self.label.draw()
+
+    def dump(self, dt=None):
+        summary = self.monitor.summary()
+        self.monitor.reset_totals()
+
+        if self.settings.dump_file is None:
+            print(f'queries: {summary["statements"]} statements, '
+                  f'{summary["rows"]} rows, '
+                  f'{summary["seconds"] * 1000:.1f} ms in '
+                  f'{summary["frames"]} frames, at most '
+                  f'{summary["max_statements_per_frame"]} per frame')
+            for name, stats in list(summary['callers'].items())[:5]:
+                print(f'    {stats["statements"]:6} {name}')
+        else:
+            with open(DATA_DIR / self.settings.dump_file, 'a') as f:
+                f.write(json.dumps(summary))
+                f.write('\n')
+
+
+@injectable("application")
+class StartupService(Injectable):
+    """Notifies the startup trace once the first frame is done."""
+
+    @dataclass
+    class Dependencies(Injectable.Dependencies):
+        ui_loop: UILoop
+
+    def on_init(self):
+        self.subscription = self.ui_loop.on_update.subscribe(self.on_update)
+
+    def on_update(self, dt):
+        self.subscription.cancel()
+        # the frame is drawn by the remaining subscribers, so wait for the
+        # next tick
+        clock.schedule_once(self.on_first_frame, 0)
+
+    def on_first_frame(self, dt):
+        startup.on_first_frame()
+
+
+@injectable("application")
+class RouterService(Injectable):
+    def on_init(self):
+        self.view = 'events'
+
+
+@component("menu")
+class Menu(Div):
+    @dataclass
+    class Dependencies(Div.Dependencies):
+        router: RouterService = None
+
+    @dataclass
+    class Properties(Div.Properties):
+        pass
+
+    def navigate(self, target):
+        self.dependencies.router.view = target
+
+    def on_home(self):
+        self.navigate('todo')
+
+    def on_lists(self):
+        self.navigate('events')
+
+
+@component(name="router_outlet")
+class RouterOutlet(Container):
+    @dataclass
+    class Dependencies(Container.Dependencies):
+        router: RouterService = None
+
+    @dataclass
+    class Properties(Container.Properties):
+        pass
+
+    @property
+    def view(self):
+        return self.dependencies.router.view
+
+
+@component(name="todo_view")
+class TodoView(Div):
+    @dataclass
+    class Dependencies(Div.Dependencies):
+        todo_service: TodoService = None
+
+    @dataclass
+    class Properties(Div.Properties):
+        pass
+
+    def work_time(self):
+        timedelta = self.dependencies.todo_service.work_time()
+        hours, remainder = divmod(timedelta.total_seconds(), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{int(hours):02}:{int(minutes):02}"
+
+
+@dataclass
+class Color:
+    """ """
+
+    red: float = 0.
+    green: float = 0.
+    blue: float = 0.
+    alpha: float = 0.
+
+    @classmethod
+    def white(cls):
+        return Color(1, 1, 1, 1)
+
+
+@component(name="exp_display")
+class ExpDisplay(Div):
+    @dataclass
+    class Dependencies(Div.Dependencies):
+        exp_service: model.ExpService = None
+
+    @property
+    def progress(self):
+        return self.dependencies.exp_service.progress
+
+    @property
+    def text(self):
+        exp = self.dependencies.exp_service
+
+        return (f'{exp.exp}/{exp.next_level} '
+                f'({int(exp.progress*100)}%) '
+                f'Level: {exp.level}')
+
+
+@component(name="exp_bar", template=None)
+class ExpBar(UIComponent):
+    @dataclass
+    class Dependencies(UIComponent.Dependencies):
+        pass
+
+    @dataclass
+    class Properties(UIComponent.Properties):
+        progress: float = 0.3
+        background: Color = field(default_factory=Color)
+        border: Color = field(default_factory=Color)
+        fill: Color = field(default_factory=Color)
+        fill_darken: float = 0.
+        width: int = 100
+        height: int = 20
+
+    NUM_TICKS = 20
+
+    def on_init(self):
+        super().on_init()
+        self.layers_key = None
+        self.under = None
+        self.over = None
+        self.gradient = None
+        self.bar_key = None
+        self.bar = None
+
+    @property
+    def width(self):
+        return self.properties.width
+
+    @property
+    def height(self):
+        return self.properties.height
+
+    def layer_key(self, width, height):
+        properties = self.properties
+        return (width, height,
+                astuple(properties.background),
+                astuple(properties.border),
+                astuple(properties.fill),
+                properties.fill_darken)
+
+    def render_layers(self, width, height):
+        """Render the parts that do not depend on progress.
+
+        The background is drawn below the fill, border and ticks above.
+        """
+        self.under = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(self.under)
+        ctx.rectangle(0.5, 0.5, width - 1, height - 1)
+        color = self.properties.background
+        ctx.set_source_rgba(color.red, color.green, color.blue, color.alpha)
+        ctx.fill()
+
+        color = self.properties.fill
+        darken = self.properties.fill_darken
+        self.gradient = cairo.LinearGradient(0, 0, 0, height)
+        self.gradient.add_color_stop_rgb(
+            0., color.red, color.green, color.blue)
+        self.gradient.add_color_stop_rgb(
+            1., color.red * darken, color.green * darken, color.blue * darken)
+
+        self.over = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(self.over)
+        ctx.set_line_width(1)
+        color = self.properties.border
+        ctx.set_source_rgba(color.red, color.green, color.blue, color.alpha)
+
+        ctx.rectangle(0.5, 0.5, width - 1, height - 1)
+
+        tick_size = width // self.NUM_TICKS
+        pos = 0.5
+        for i in range(1, self.NUM_TICKS):
+            pos += tick_size
+            ctx.move_to(pos, 0)
+            ctx.line_to(pos, height)
+
+        ctx.stroke()
+
+    def render_bar(self, width, height, fill_width):
+        if self.bar is None \
+                or (self.bar.get_width(), self.bar.get_height()) \
+                != (width, height):
+            self.bar = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+
+        ctx = cairo.Context(self.bar)
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.set_source_surface(self.under)
+        ctx.paint()
+        ctx.set_operator(cairo.OPERATOR_OVER)
+
+        if fill_width > 0:
+            ctx.rectangle(0.5, 0.5, fill_width, height - 1)
+            ctx.set_source(self.gradient)
+            ctx.fill()
+
+        ctx.set_source_surface(self.over)
+        ctx.paint()
+
+    def on_draw(self, ctx):
+        position = self.properties.position
+        width = math.ceil(position.width)
+        height = math.ceil(position.height)
+
+        if width > 0 and height > 0:
+            key = self.layer_key(width, height)
+            if key != self.layers_key:
+                self.render_layers(width, height)
+                self.layers_key = key
+
+            # only redraw the bar if the fill changes by a device pixel
+            fill_width = round((position.width - 1) * self.properties.progress)
+            if (key, fill_width) != self.bar_key:
+                self.render_bar(width, height, fill_width)
+                self.bar_key = (key, fill_width)
+
+            with ctx:
+                ctx.set_source_surface(self.bar, position.left, position.top)
+                ctx.paint()
+
+        super().on_draw(ctx)
+
+
+@component(name="event_list")
+class EventList(Div):
+    @dataclass
+    class Dependencies(Div.Dependencies):
+        history: model.EventHistory
+
+    @dataclass
+    class Properties(Div.Properties):
+        pass
+
+    def on_init(self):
+        super().on_init()
+        self.date_text = ''
+
+    @property
+    def events(self):
+        return self.dependencies.history.events
+
+    @property
+    def date_valid(self):
+        try:
+            self.as_date()
+        except ValueError:
+            return not self.date_text
+        else:
+            return True
+
+    def as_date(self):
+        return datetime.date.fromisoformat(self.date_text)
+
+    def on_newer(self):
+        self.dependencies.history.newer()
+
+    def on_older(self):
+        self.dependencies.history.older()
+
+    def on_jump(self, text):
+        if self.date_text and self.date_valid:
+            self.dependencies.history.jump_to(self.as_date())
+
+
+@component("time_edit")
+class TimeEdit(Div):
+    @dataclass
+    class Dependencies(Div.Dependencies):
+        event_edit: model.EventEditService
+
+    @dataclass
+    class Properties(Div.Properties):
+        event: Optional[model.Event] = None
+        on_update: Optional[Callable[datetime.datetime, None]] = None
+
+    @property
+    def edit(self):
+        return self.time is not None
+
+    @property
+    def time(self):
+        return self.dependencies.event_edit.get_edit(self.properties.event)
+
+    @property
+    def valid(self):
+        try:
+            self.as_date()
+        except ValueError:
+            return False
+        else:
+            return True
+
+    def as_date(self):
+        return datetime.datetime.fromisoformat(self.time)
+
+    @time.setter
+    def time(self, value):
+        self.dependencies.event_edit.set_edit(self.properties.event, value)
+
+    def format_time(self):
+        return str(self.properties.event.time)[:19]
+
+    def start_edit(self):
+        self.time = self.format_time()
+
+    def save(self, text):
+        if self.valid:
+            event = self.properties.event
+            self.dependencies.event_edit.write_edit(event, self.time)
+
+
+@component(name="event")
+class EventComponent(Div):
+    @dataclass
+    class Properties(Div.Properties):
+        event: model.Event = None
+
+    @dataclass
+    class Dependencies(Div.Dependencies):
+        pass
+
+    @property
+    def event(self):
+        return self.properties.event
+
+    def format_time(self):
+        return str(self.event.time)[:19]
+
+
+@component("todo")
+class TodoComponent(Container):
+
+    @dataclass
+    class Dependencies(Container.Dependencies):
+        todo_service: TodoService = None
+
+    @dataclass
+    class Properties(Container.Properties):
+        pass
+
+    SEARCH_DELAY = 0.15
+    """Seconds without typing before the search runs."""
+
+    def on_init(self):
+        self.text = ''
+        self._search_text = ''
+        self.results = None
+
+    def on_destroy(self):
+        clock.unschedule(self.search)
+
+    @property
+    def todos(self):
+        if self.results is not None:
+            return self.results
+        return self.dependencies.todo_service.todos
+
+    @property
+    def search_text(self):
+        return self._search_text
+
+    @search_text.setter
+    def search_text(self, value):
+        if value == self._search_text:
+            return
+
+        self._search_text = value
+        clock.unschedule(self.search)
+        clock.schedule_once(self.search, self.SEARCH_DELAY)
+
+    def search(self, dt=None):
+        clock.unschedule(self.search)
+        todo_service = self.dependencies.todo_service
+        if self.search_text.strip():
+            self.results = todo_service.search(
+                self.search_text, group=todo_service.selected_group)
+        else:
+            self.results = None
+
+    @property
+    def task_groups(self):
+        return self.dependencies.todo_service.task_groups
+
+    def select_group(self, group):
+        self.dependencies.todo_service.select_group(group)
+        if self.results is not None:
+            self.search()
+
+    def group_counts(self, group):
+        return self.dependencies.todo_service.group_counts(group)
+
+    @property
+    def counts(self):
+        return self.group_counts(
+            self.dependencies.todo_service.selected_group)
+
+    def add_clicked(self):
+        todo_service = self.dependencies.todo_service
+        todo_service.add(self.text)
+        self.text = ''
+
+    def input_submit(self, text):
+        self.add_clicked()
+
+
+@component(name="todolist")
+class TodoList(Container):
+
+    @dataclass
+    class Properties(Container.Properties):
+        todos: list = field(default_factory=list)
+
+    @property
+    def todos(self):
+        return self.properties.todos
+
+
+@component("todo_item")
+class Todo(Container):
+    @dataclass
+    class Dependencies(Container.Dependencies):
+        todo_service: TodoService
+
+    @dataclass
+    class Properties(Container.Properties):
+        item: model.Todo = None
+
+    def on_init(self):
+        self.destroyed = False
+        super().on_init()
+
+    def on_draw(self, canvas):
+        super().on_draw(canvas)
+
+    @property
+    def item(self):
+        return self.properties.item
+
+    def checkbox_clicked(self):
+        self.dependencies.todo_service.toggle_done(self.item)
+
+    def checkbox_svg(self):
+        if self.item.done:
+            return res.paths['checkbox_ticked']
+        else:
+            return res.paths['checkbox_blank']
+
+    def delete_svg(self):
+        return res.paths['delete']
+
+    def get_checkbox_class(self):
+        if self.item.done:
+            return 'checkbox_ticked'
+        else:
+            return 'checkbox'
+
+    def delete_clicked(self):
+        self.dependencies.todo_service.remove(self.item)
+
+    def on_destroy(self):
+        self.destroyed = True
+        super().on_destroy()
+
+    def on_select(self):
+        self.dependencies.todo_service.select(self.item)
+
+    def is_selected(self):
+        return self.dependencies.todo_service.is_selected(self.item)
@@ -0,0 +1,456 @@
+"""Benchmarks of the model layer against synthetic histories.
+
+    python -m dotrack.bench run --sizes 1000 100000 1000000 -o new.json
+    python -m dotrack.bench compare base.json new.json
+
+run generates (and keeps for later runs) a database per size in the
+scratch directory, then times the hot paths headless, with the services
+constructed against a scratch config. The benchmarks write to the
+database, so each run works on a fresh copy of the generated one.
+compare reports the change of the median per benchmark and fails if any
+got slower than the threshold.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+import peewee
+
+from dotrack import model
+from dotrack.config import Config, SaveState
+from dotrack.model import (db, TaskGroup, Todo, EventType, Event, ExpType,
+                           ExpEvent, ExpLedger, WorkSession, exp_table)
+from dotrack.startup import startup
+
+SCRATCH_DIR = Path(tempfile.gettempdir()) / 'dotrack-bench'
+
+BATCH_SIZE = 1000
+
+
+class BenchConfig(Config):
+    CONFIG_FILE = SCRATCH_DIR / 'config.yml'
+
+
+class BenchSaveState(SaveState):
+    CONFIG_FILE = SCRATCH_DIR / 'state.yml'
+
+
+def group_names(count):
+    return [f'group {i}' for i in range(count)]
+
+
+class HistoryGenerator:
+    """Simulates working days with pomodoro sessions on a set of todos.
+
+    A day starts with APP_START between 7 and 10, followed by sessions of
+    about 25 minutes with short breaks until the evening and ends with
+    APP_STOP. Some sessions are never stopped, some todos are done after
+    a few sessions. The last day is today.
+    """
+
+    SESSION = 25 * 60
+    OPEN_TODOS = 8
+
+    def __init__(self, groups, todos, events, seed=0):
+        self.groups = groups
+        self.todos = todos
+        self.events = events
+        self.random = random.Random(seed)
+
+        self.next_todo_id = 1
+        self.open_todos = dict()
+        self.todo_rows = list()
+
+    def new_todo(self):
+        todo_id = self.next_todo_id
+        self.next_todo_id += 1
+        sessions = self.events / 2 / self.todos
+        self.open_todos[todo_id] = (
+            self.random.randint(1, max(1, round(2 * sessions))),
+            self.random.randint(1, self.groups))
+        return todo_id
+
+    def work_on(self):
+        while len(self.open_todos) < self.OPEN_TODOS:
+            self.new_todo()
+        return self.random.choice(list(self.open_todos))
+
+    def finish(self, todo_id, time):
+        """Count a session on todo_id, yields exp events when done."""
+        sessions, group = self.open_todos[todo_id]
+        if sessions > 1:
+            self.open_todos[todo_id] = (sessions - 1, group)
+            return
+
+        del self.open_todos[todo_id]
+        self.todo_rows.append(
+            (todo_id, f'todo {todo_id}', time, False, group))
+        yield (exp_table['raw_exp']['toggle'], ExpType.DONE, time, todo_id)
+
+    def day(self, date):
+        """Yield (event, exp_event) rows of one day, one of them is None."""
+        time = datetime.datetime.combine(date, datetime.time(7)) \
+            + datetime.timedelta(minutes=self.random.randint(0, 180))
+        evening = datetime.datetime.combine(date, datetime.time(17)) \
+            + datetime.timedelta(minutes=self.random.randint(0, 120))
+
+        yield (None, EventType.APP_START, time), None
+        while time < evening:
+            todo_id = self.work_on()
+            time += datetime.timedelta(seconds=self.random.randint(5, 60))
+            yield (todo_id, EventType.START, time), None
+
+            time += datetime.timedelta(
+                seconds=self.SESSION + self.random.randint(-120, 120))
+            if self.random.random() < 0.9:
+                yield (todo_id, EventType.STOP, time), None
+                yield None, (exp_table['raw_exp']['reset'], ExpType.RESET,
+                             time, None)
+
+            for exp_event in self.finish(todo_id, time):
+                yield None, exp_event
+
+            time += datetime.timedelta(
+                minutes=self.random.choice((5, 5, 5, 10, 15, 30)))
+
+        yield (None, EventType.APP_STOP, time), None
+
+    def rows(self):
+        """Yield (event, exp_event) rows of about self.events events."""
+        events_per_day = 2 + 2 * 8 * 60 // 33
+        days = max(1, self.events // events_per_day + 1)
+        first = datetime.date.today() - datetime.timedelta(days=days - 1)
+
+        count = 0
+        date = first
+        while count < self.events:
+            for event, exp_event in self.day(date):
+                if event is not None:
+                    count += 1
+                yield event, exp_event
+                if count >= self.events:
+                    return
+            date += datetime.timedelta(days=1)
+
+    def run(self):
+        database = db()
+        TaskGroup.get_groups(group_names(self.groups))
+        group_ids = {
+            int(name.split()[-1]) + 1: group_id
+            for group_id, name in TaskGroup.select(
+                TaskGroup.task_group_id, TaskGroup.name).tuples()}
+
+        def insert_events(rows):
+            Event.insert_many(rows, fields=[
+                Event.todo, Event.event_type, Event.time]).execute()
+
+        def insert_exp_events(rows):
+            ExpEvent.insert_many(rows, fields=[
+                ExpEvent.exp, ExpEvent.event_type, ExpEvent.time,
+                ExpEvent.todo]).execute()
+
+        events, exp_events = list(), list()
+        with database.atomic():
+            for event, exp_event in self.rows():
+                if event is not None:
+                    events.append(event)
+                if exp_event is not None:
+                    exp_events.append(exp_event)
+
+                if len(events) >= BATCH_SIZE:
+                    insert_events(events)
+                    events = list()
+                if len(exp_events) >= BATCH_SIZE:
+                    insert_exp_events(exp_events)
+                    exp_events = list()
+
+            if events:
+                insert_events(events)
+            if exp_events:
+                insert_exp_events(exp_events)
+
+            for todo_id, (sessions, group) in self.open_todos.items():
+                self.todo_rows.append(
+                    (todo_id, f'todo {todo_id}', None, False, group))
+
+            todo_rows = ((todo_id, text, done, deleted, group_ids[group])
+                         for todo_id, text, done, deleted, group
+                         in self.todo_rows)
+            for batch in peewee.chunked(todo_rows, BATCH_SIZE):
+                Todo.insert_many(batch, fields=[
+                    Todo.todo_id, Todo.text, Todo.done, Todo.deleted,
+                    Todo.group]).execute()
+
+        WorkSession.rebuild()
+        ExpLedger.rebuild()
+
+
+def generate(path, groups, todos, events, seed=0):
+    """Fill a new database at path with a synthetic history."""
+    path.unlink(missing_ok=True)
+    db.SAVE_FILE = path
+    db.connect()
+    try:
+        HistoryGenerator(groups, todos, events, seed).run()
+    finally:
+        db.close()
+
+
+def is_up_to_date(path):
+    connection = sqlite3.connect(path)
+    try:
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        connection.close()
+    return version == model.schema_fingerprint(db.models())
+
+
+def database_for(size, seed=0, scratch=SCRATCH_DIR):
+    path = scratch / f'events-{size}-seed{seed}.db'
+    # databases of an older schema would ask to be evolved
+    if not path.exists() or not is_up_to_date(path):
+        print(f'generating {path}')
+        start = time.perf_counter()
+        generate(path, groups=5, todos=max(10, size // 50), events=size,
+                 seed=seed)
+        print(f'generated in {time.perf_counter() - start:.1f}s')
+    return path
+
+
+def working_copy(path):
+    """Fresh copy of the generated database at path to run against."""
+    copy = path.with_name(f'run-{path.name}')
+    for suffix in ('-wal', '-shm'):
+        copy.with_name(copy.name + suffix).unlink(missing_ok=True)
+    shutil.copyfile(path, copy)
+    return copy
+
+
+class Services:
+    """The model services constructed headless, as the app would."""
+
+    def __init__(self, groups):
+        self.config = BenchConfig(BenchConfig.Dependencies())
+        self.config[model.TodoServiceSettings].task_groups = groups
+        self.save = BenchSaveState(BenchSaveState.Dependencies())
+
+        self.todo_service = model.TodoService(model.TodoService.Dependencies(
+            config=self.config, save=self.save))
+        self.timer = model.Timer(model.Timer.Dependencies(
+            todo_service=self.todo_service, config=self.config,
+            save=self.save))
+        self.exp_service = model.ExpService(model.ExpService.Dependencies(
+            todo=self.todo_service, timer=self.timer))
+
+        # not part of the first frame
+        startup.deferred.clear()
+        startup.records.clear()
+
+    def close(self):
+        self.exp_service.on_destroy()
+        self.timer.on_destroy()
+        self.todo_service.on_destroy()
+        self.save.on_destroy()
+
+
+def benchmarks(services, groups):
+    todo_service = services.todo_service
+    exp_service = services.exp_service
+
+    def todos():
+        todo_service.invalidate_todos()
+        return todo_service.todos
+
+    def work_time():
+        todo_service.work_time_tracker.reload()
+        return todo_service.work_time()
+
+    def raw_exp():
+        exp_service.set_ledger(ExpLedger.load())
+        return exp_service.raw_exp()
+
+    def verify_ledger():
+        return ExpLedger.verify()
+
+    def event_list():
+        history = model.EventHistory(model.EventHistory.Dependencies(
+            todo_service=todo_service))
+        events = history.events
+        history.on_destroy()
+        return events
+
+    first = Event.select(peewee.fn.MIN(Event.time)).scalar()
+    middle = first + (datetime.datetime.now() - first) / 2
+
+    def event_list_jump():
+        history = model.EventHistory(model.EventHistory.Dependencies(
+            todo_service=todo_service))
+        history.jump_to(middle.date())
+        history.older()
+        history.on_destroy()
+
+    def get_or_create():
+        return model.get_or_create_by_name(groups, TaskGroup)
+
+    def evolve():
+        model.Evolve(db(), db.models(), require_confirm=False).evolve()
+
+    def search():
+        return todo_service.search('todo 12')
+
+    def session_rebuild_today():
+        WorkSession.rebuild(since=model.start_of_day(datetime.date.today()))
+
+    return {
+        'todos': todos,
+        'work_time': work_time,
+        'raw_exp': raw_exp,
+        'verify_ledger': verify_ledger,
+        'event_list': event_list,
+        'event_list_jump': event_list_jump,
+        'get_or_create_by_name': get_or_create,
+        'evolve': evolve,
+        'session_rebuild_today': session_rebuild_today,
+        'search': search,
+    }
+
+
+def measure(fn, repeat):
+    runs = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+
+    return {
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'runs': runs,
+    }
+
+
+def run(sizes, repeat=5, seed=0, scratch=SCRATCH_DIR, only=None):
+    scratch.mkdir(parents=True, exist_ok=True)
+    BenchConfig.CONFIG_FILE = scratch / 'config.yml'
+    BenchSaveState.CONFIG_FILE = scratch / 'state.yml'
+    groups = group_names(5)
+
+    results = dict()
+    for size in sizes:
+        db.SAVE_FILE = working_copy(database_for(size, seed, scratch))
+        BenchSaveState.CONFIG_FILE.unlink(missing_ok=True)
+        size_results = results[str(size)] = dict()
+
+        if only is None or 'startup' in only:
+            size_results['startup'] = measure(
+                lambda: Services(groups).close(), repeat)
+
+        current = Services(groups)
+        try:
+            for name, fn in benchmarks(current, groups).items():
+                if only is not None and name not in only:
+                    continue
+                size_results[name] = measure(fn, repeat)
+        finally:
+            current.close()
+
+        for name, result in size_results.items():
+            print(f'{size:>9} {name:<24} {result["median"] * 1000:9.3f} ms')
+
+    return {
+        'meta': {
+            'time': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'peewee': peewee.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(base, new, threshold=0.1):
+    """Print the change per benchmark, returns the regressions."""
+    regressions = list()
+    for size, benches in new['results'].items():
+        base_benches = base['results'].get(size, dict())
+        for name, result in benches.items():
+            if name not in base_benches:
+                print(f'{size:>9} {name:<24} {"new":>9}')
+                continue
+
+            before = base_benches[name]['median']
+            after = result['median']
+            ratio = after / before if before else float('inf')
+            mark = ''
+            if ratio > 1 + threshold:
+                mark = '  regression'
+                regressions.append((size, name, ratio))
+            elif ratio < 1 - threshold:
+                mark = '  improvement'
+            print(f'{size:>9} {name:<24} {before * 1000:9.3f} ms '
+                  f'-> {after * 1000:9.3f} ms {ratio:6.2f}x{mark}')
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dotrack.bench',
+        description='Benchmark the model layer on synthetic histories.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+        help='number of events of the generated histories')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument(
+        '--scratch', type=Path, default=SCRATCH_DIR,
+        help='directory for the generated databases and config')
+    run_parser.add_argument(
+        '--only', nargs='+', help='names of the benchmarks to run')
+    run_parser.add_argument(
+        '-o', '--output', type=Path, help='write the results as JSON')
+
+    compare_parser = commands.add_parser(
+        'compare', help='compare two result files')
+    compare_parser.add_argument('base', type=Path)
+    compare_parser.add_argument('new', type=Path)
+    compare_parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='relative slowdown of the median counted as regression')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.sizes, args.repeat, args.seed, args.scratch,
+                      args.only)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        if compare(base, new, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,174 @@
 import yaml
 import dataclasses
+import hashlib
+import os
+import threading
+import traceback
 import typing
 
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from dotrack.shared import DATA_DIR
+from dotrack.startup import startup
 from guiml.injectables import Injectable, injectable
 
 
-def structure(data, data_type):
+# use libyaml if available
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+_structurers = dict()
+_destructurers = dict()
+
+
+def identity(data):
+    return data
+
+
+def compile_structure(data_type):
+    """Return a function structuring data as data_type.
+
+    The type is only inspected once, the returned function is cached.
+    """
+    try:
+        return _structurers[data_type]
+    except KeyError:
+        pass
+
     origin = typing.get_origin(data_type)
     type_args = typing.get_args(data_type)
-    if data is None:
-        return None
-    elif origin is not None:
 
-        if origin is typing.Union:
-            if len(type_args) == 2 and type(None) in type_args:
+    def unsupported(data):
+        raise NotImplementedError(
+            f'Trying to structure {data_type.__name__}')
+
+    if origin is not None:
+        if (origin is typing.Union and len(type_args) == 2
+                and type(None) in type_args):
+            field_type = next(iter((t for t in type_args
+                                    if t is not type(None))))
+            result = compile_structure(field_type)
+
+        elif origin is list:
+            structure_item = compile_structure(type_args[0])
+
+            def result(data):
                 if data is None:
                     return None
-                else:
-                    field_type = next(
-                        iter((t for t in type_args
-                              if t is not type(None))))
-                    return structure(
-                        data, field_type)
-
-        elif isinstance(data, origin):
-            if isinstance(data, list):
-                data = [structure(x, type_args[0]) for x in data]
-                return data
+                elif isinstance(data, list):
+                    return [structure_item(x) for x in data]
+                return unsupported(data)
 
-        raise NotImplementedError(f'Trying to structure {data_type.__name__}')
+        else:
+            def result(data):
+                if data is None:
+                    return None
+                return unsupported(data)
 
-    elif isinstance(data, data_type):
-        return data
     elif dataclasses.is_dataclass(data_type):
-        args = dict()
-        for field in dataclasses.fields(data_type):  # noqa: F402
-            try:
-                value = data[field.name]
-            except KeyError:
-                pass
-            else:
-                args[field.name] = structure(value, field.type)
+        field_types = typing.get_type_hints(data_type)
+        fields = [
+            (field.name, compile_structure(field_types[field.name]))
+            for field in dataclasses.fields(data_type)
+        ]
+
+        def result(data):
+            if data is None or isinstance(data, data_type):
+                return data
+
+            args = dict()
+            for name, structure_field in fields:
+                try:
+                    value = data[name]
+                except KeyError:
+                    pass
+                else:
+                    args[name] = structure_field(value)
+
+            return data_type(**args)
 
-        return data_type(**args)
     else:
-        return data
+        result = identity
+
+    _structurers[data_type] = result
+    return result
+
+
+def structure(data, data_type):
+    return compile_structure(data_type)(data)
+
+
+def compile_destructure(data_type):
+    """Return a function turning a data_type instance into plain data."""
+    try:
+        return _destructurers[data_type]
+    except KeyError:
+        pass
+
+    field_types = typing.get_type_hints(data_type)
+    fields = list()
+    for field in dataclasses.fields(data_type):
+        field_type = field_types[field.name]
+        if typing.get_origin(field_type) is typing.Union:
+            field_type = next(iter(t for t in typing.get_args(field_type)
+                                   if t is not type(None)))
+
+        if field_type in (bool, int, float, str):
+            fields.append((field.name, identity))
+        else:
+            fields.append((field.name, destructure))
+
+    def result(data):
+        return {name: destructure_field(getattr(data, name))
+                for name, destructure_field in fields}
+
+    _destructurers[data_type] = result
+    return result
 
 
 def destructure(data):
     if dataclasses.is_dataclass(data):
-        result = dataclasses.asdict(data)
-        return destructure(result)
+        return compile_destructure(type(data))(data)
     elif isinstance(data, dict):
         return {key: destructure(value) for key, value in data.items()}
-    elif isinstance(data, list):
+    elif isinstance(data, (list, tuple)):
         return [destructure(value) for value in data]
     else:
         return data
 
 
+def track_changes(config_class):
+    """Count assignments to attributes of instances in _version.
+
+    After each assignment the callable in _on_change is called, if set.
+    Changes inside mutable field values are not noticed.
+    """
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        state = self.__dict__
+        object.__setattr__(self, '_version', state.get('_version', 0) + 1)
+        on_change = state.get('_on_change')
+        if on_change is not None:
+            on_change()
+
+    config_class.__setattr__ = __setattr__
+    return config_class
+
+
+def content_hash(content):
+    return hashlib.sha256(content).digest()
+
+
+def atomic_write(path, content):
+    """Replace the file at path, readers see either the old or new file."""
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
 @injectable("application")
 class Config(Injectable):
     CONFIG_FILE = DATA_DIR / "config.yml"
@@ -82,18 +189,25 @@ class Config(Injectable):
             raise ValueError('Doublicate config class name.')
 
         cls.CONFIG_CLASSES[key] = config_class
+        compile_structure(config_class)
+        compile_destructure(config_class)
         return config_class
 
+    @startup.timed
     def on_init(self):
         self.config = None
+        self.written_hash = None
         self.load_config()
-        self.write_config()
+        # only adds missing defaults to the file, no need to wait for it
+        startup.after_first_frame(self.write_config)
 
     def load_config(self):
         data = None
         if self.CONFIG_FILE.exists():
-            with open(self.CONFIG_FILE, 'r') as f:
-                data = yaml.load(f, Loader=yaml.SafeLoader)
+            with open(self.CONFIG_FILE, 'rb') as f:
+                content = f.read()
+            self.written_hash = content_hash(content)
+            data = yaml.load(content, Loader=YAML_LOADER)
         if data is None:
             data = {}
 
@@ -104,11 +218,22 @@ class Config(Injectable):
             else:
                 self.config[key] = config_class()
 
+    def serialize(self):
+        data = {
+            key: compile_destructure(type(value))(value)
+            for key, value in self.config.items()
+        }
+        return yaml.dump(data, Dumper=YAML_DUMPER).encode('utf-8')
+
     def write_config(self):
-        data = {key: destructure(value) for key, value in self.config.items()}
+        """Write the config, if it differs from the file content."""
+        content = self.serialize()
+        new_hash = content_hash(content)
+        if new_hash == self.written_hash:
+            return
 
-        with open(self.CONFIG_FILE, 'w') as f:
-            yaml.dump(data, f)
+        atomic_write(self.CONFIG_FILE, content)
+        self.written_hash = new_hash
 
     def __getitem__(self, config_class):
         return self.config[self.get_key(config_class)]
@@ -116,12 +241,80 @@ class Config(Injectable):
 
 @injectable("application")
 class SaveState(Config):
+    """Config for state, written in the background whenever it changes.
+
+    Registered classes track their changes, a checkpoint thread writes
+    the file CHECKPOINT_DELAY seconds after the last change, so that the
+    state survives a crash. Only changed sections are serialized again.
+    """
+
     CONFIG_FILE = DATA_DIR / "state.yml"
     CONFIG_CLASSES = dict()
 
+    CHECKPOINT_DELAY = 2.
+
+    @classmethod
+    def register(cls, config_class):
+        return track_changes(super().register(config_class))
+
+    @startup.timed
     def on_init(self):
         self.config = None
+        self.written_hash = None
         self.load_config()
 
+        # section key -> (version, serialized section)
+        self.sections = dict()
+        self.write_lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.stopping = threading.Event()
+
+        for value in self.config.values():
+            object.__setattr__(value, '_on_change', self.dirty.set)
+
+        self.thread = threading.Thread(
+            target=self.run, name='dotrack-checkpoint', daemon=True)
+        self.thread.start()
+
     def on_destroy(self):
+        self.stopping.set()
+        self.dirty.set()
+        self.thread.join()
         self.write_config()
+
+    def run(self):
+        while True:
+            self.dirty.wait()
+
+            # debounce, wait until nothing changed for CHECKPOINT_DELAY
+            while self.dirty.is_set() and not self.stopping.is_set():
+                self.dirty.clear()
+                self.stopping.wait(self.CHECKPOINT_DELAY)
+
+            if self.stopping.is_set():
+                return
+
+            try:
+                self.write_config()
+            except Exception:
+                traceback.print_exc()
+
+    def serialize(self):
+        parts = list()
+        for key in sorted(self.config):
+            value = self.config[key]
+            # read the version first, a change while serializing is then
+            # picked up by the next checkpoint
+            version = value.__dict__.get('_version')
+            cached = self.sections.get(key)
+            if cached is None or cached[0] != version:
+                data = {key: compile_destructure(type(value))(value)}
+                cached = (version, yaml.dump(data, Dumper=YAML_DUMPER))
+                self.sections[key] = cached
+            parts.append(cached[1])
+
+        return ''.join(parts).encode('utf-8')
+
+    def write_config(self):
+        with self.write_lock:
+            super().write_config()
@@ -1,4 +1,9 @@
+import functools
+import hashlib
+import mmap
+import os
 import re
+import struct
 
 from dataclasses import dataclass
 from pathlib import Path
@@ -7,6 +12,8 @@ from guiml.resources import ResourceManager
 from guiml.components import Container
 from guiml.components import component as guiml_component
 
+from dotrack.shared import DATA_DIR
+
 BASE_DIR = Path(__file__).parent.resolve()
 
 res = ResourceManager(
@@ -53,12 +60,14 @@ def load_icon_codepoints_css():
     return result
 
 
-def load_icon_codepoints_simple():
-    css_path = Path.home() / ".local/share/fonts/MaterialSymbolsOutlined[FILL,GRAD,opsz,wght].codepoints"  # noqa: E501
+CODEPOINTS_PATH = Path.home() / ".local/share/fonts/MaterialSymbolsOutlined[FILL,GRAD,opsz,wght].codepoints"  # noqa: E501
+CODEPOINTS_INDEX = DATA_DIR / "icon_codepoints.idx"
+
 
+def load_icon_codepoints_simple(path=CODEPOINTS_PATH):
     result = dict()
 
-    with open(css_path) as file:
+    with open(path) as file:
         for line in file:
             name, codepoint = line.split()
             result[name] = chr(int(codepoint, 16))
@@ -66,10 +75,113 @@ def load_icon_codepoints_simple():
     return result
 
 
+class CodepointIndex:
+    """Sorted, fixed width binary index of icon codepoints.
+
+    The file starts with a header identifying the codepoints file it was
+    built from (path hash, modification time and size), followed by one
+    record per icon, sorted by name: the name padded with zero bytes to
+    the common width and the codepoint. Lookups are a binary search on the
+    memory mapped file, so opening the index does not parse anything.
+    """
+
+    MAGIC = b'dtcpidx1'
+    HEADER = struct.Struct('<8sQQQI')
+    CODEPOINT = struct.Struct('<I')
+
+    def __init__(self, file, width):
+        self.file = file
+        self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.width = width
+        self.record_size = width + self.CODEPOINT.size
+        self.count = ((len(self.data) - self.HEADER.size)
+                      // self.record_size)
+
+    @classmethod
+    def source_key(cls, path):
+        stat = os.stat(path)
+        path_hash = int.from_bytes(
+            hashlib.sha256(str(path).encode()).digest()[:8], 'little')
+        return path_hash, stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def open(cls, path, source_path):
+        """Open the index, None if it is missing or outdated."""
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            return None
+
+        header = file.read(cls.HEADER.size)
+        if len(header) == cls.HEADER.size:
+            magic, *key, width = cls.HEADER.unpack(header)
+            if (magic == cls.MAGIC
+                    and tuple(key) == cls.source_key(source_path)):
+                return cls(file, width)
+
+        file.close()
+        return None
+
+    @classmethod
+    def build(cls, path, source_path):
+        codepoints = load_icon_codepoints_simple(source_path)
+        names = sorted(name.encode() for name in codepoints)
+        width = max((len(name) for name in names), default=0)
+
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as file:
+            file.write(cls.HEADER.pack(
+                cls.MAGIC, *cls.source_key(source_path), width))
+            for name in names:
+                codepoint = ord(codepoints[name.decode()])
+                file.write(name.ljust(width, b'\0'))
+                file.write(cls.CODEPOINT.pack(codepoint))
+        os.replace(tmp_path, path)
+
+        return codepoints
+
+    def name_at(self, i):
+        offset = self.HEADER.size + i * self.record_size
+        return self.data[offset:offset + self.width].rstrip(b'\0')
+
+    def get(self, name, default=None):
+        key = name.encode()
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.name_at(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < self.count and self.name_at(low) == key:
+            offset = self.HEADER.size + low * self.record_size + self.width
+            codepoint, = self.CODEPOINT.unpack_from(self.data, offset)
+            return chr(codepoint)
+        else:
+            return default
+
+
+def load_icon_codepoints_indexed(path=CODEPOINTS_PATH,
+                                 index_path=CODEPOINTS_INDEX):
+    """Load the codepoints through the on-disk index, building it if needed.
+
+    Returns an object with the get method of dict.
+    """
+    index = CodepointIndex.open(index_path, path)
+    if index is not None:
+        return index
+
+    try:
+        return CodepointIndex.build(index_path, path)
+    except OSError:
+        return load_icon_codepoints_simple(path)
+
+
 def get_icon(name):
     global _icon_codepoints
     if _icon_codepoints is None:
-        _icon_codepoints = load_icon_codepoints_simple()
+        _icon_codepoints = load_icon_codepoints_indexed()
 
     icon = _icon_codepoints.get(name, None)
     if icon is None:
@@ -91,13 +203,19 @@ class Icon(Container):
 
     @property
     def text(self):
-
-        return (f'<span font="Material Symbols Outlined" '
-                f'size="{self.properties.size}" '
-                f'color="{self.properties.color}"'
-                f'>'
-                f'{get_icon(self.properties.name)}'
-                '</span>')
+        return icon_markup(self.properties.name,
+                           self.properties.size,
+                           self.properties.color)
+
+
+@functools.lru_cache(maxsize=1024)
+def icon_markup(name, size, color):
+    return (f'<span font="Material Symbols Outlined" '
+            f'size="{size}" '
+            f'color="{color}"'
+            f'>'
+            f'{get_icon(name)}'
+            '</span>')
 
 
 def main():
@@ -3,15 +3,28 @@ from enum import Enum
 from typing import Optional
 
 import datetime
+import functools
+import hashlib
+import operator
 
 import peewee
+import queue
+import threading
 import time
+import traceback
 import re
+import weakref
+
+from playhouse.sqlite_ext import (FTS5Model, RowIDField, SearchField,
+                                  VirtualModel)
+from pyglet import clock
 
 from guiml.injectables import Injectable, injectable, Observable, Subscriber
 
 from dotrack.shared import BASE_DIR
 from dotrack.config import Config, SaveState
+from dotrack.querymonitor import MonitoredDatabase
+from dotrack.startup import startup
 
 
 class EvolveField:
@@ -24,8 +37,14 @@ class EvolveTable:
     def __init__(self, model: peewee.Model):
         self.model = model
         self.name = model._meta.table_name
+        self.virtual = issubclass(model, VirtualModel)
         self.schema = None
         self.target_schema = None
+        self.indexes = dict()
+        self.target_indexes = dict()
+        self.unique_indexes = dict()
+        self.triggers = dict()
+        self.target_triggers = dict()
         self.determine_target_schema()
 
     def determine_target_schema(self):
@@ -34,6 +53,17 @@ class EvolveTable:
         sql, params = ctx.sql(query).query()
         self.target_schema = sql
 
+        for index in self.model._meta.fields_to_index():
+            query = self.model._schema._create_index(index, safe=False)
+            ctx = self.model._meta.database.get_sql_context()
+            sql, params = ctx.sql(query).query()
+            self.target_indexes[index._name] = sql
+            if index._unique:
+                self.unique_indexes[index._name] = index._expressions
+
+        self.target_triggers.update(change_triggers(self.model))
+        self.target_triggers.update(search_triggers(self.model))
+
     def needs_change(self):
         return (self.schema
                 and self.target_schema
@@ -91,6 +121,197 @@ class EvolveTable:
 
         return actions
 
+    def check_indexes(self):
+        actions = []
+        db = self.model._meta.database
+
+        for name, schema in self.indexes.items():
+            if self.target_indexes.get(name) != schema:
+                sql = f'DROP INDEX "{name}";'
+                print(sql)
+
+                def drop_index(db=db, sql=sql):
+                    db.execute_sql(sql)
+
+                actions.append(drop_index)
+
+        for name, schema in self.target_indexes.items():
+            if self.indexes.get(name) != schema:
+                if name in self.unique_indexes:
+                    actions.append(self.remove_duplicates(
+                        self.unique_indexes[name]))
+
+                sql = f'{schema};'
+                print(sql)
+
+                def create_index(db=db, sql=sql):
+                    db.execute_sql(sql)
+
+                actions.append(create_index)
+
+        return actions
+
+    def check_triggers(self):
+        actions = []
+        db = self.model._meta.database
+
+        for name, schema in self.triggers.items():
+            if self.target_triggers.get(name) != schema:
+                sql = f'DROP TRIGGER "{name}";'
+                print(sql)
+
+                def drop_trigger(db=db, sql=sql):
+                    db.execute_sql(sql)
+
+                actions.append(drop_trigger)
+
+        for name, schema in self.target_triggers.items():
+            if self.triggers.get(name) != schema:
+                sql = f'{schema};'
+                # new tables are already reported as a whole
+                if self.schema is not None:
+                    print(sql)
+
+                def create_trigger(db=db, sql=sql):
+                    db.execute_sql(sql)
+
+                actions.append(create_trigger)
+
+        return actions
+
+    def remove_duplicates(self, fields):
+        """Action merging rows with equal fields into the one with the
+        smallest primary key, so that a unique index can be created.
+
+        References to removed rows are moved to the kept row, rows
+        referencing them by primary key are deleted.
+        """
+        model = self.model
+        print(f'remove duplicates of {", ".join(f.name for f in fields)} '
+              f'from "{self.name}"')
+
+        def remove(model=model, fields=fields):
+            primary_key = model._meta.primary_key
+            keep = (model
+                    .select(peewee.fn.MIN(primary_key))
+                    .group_by(*fields))
+
+            for foreign_key, ref_model in model._meta.backrefs.items():
+                if foreign_key.primary_key:
+                    (ref_model.delete()
+                     .where(foreign_key.not_in(keep))
+                     .execute())
+                    continue
+
+                # the correlated reference to the updated row must not be
+                # aliased like fields in a subquery are
+                reference = peewee.Entity(ref_model._meta.table_name,
+                                          foreign_key.column_name)
+                Row = model.alias()
+                Kept = model.alias()
+                kept = (Kept
+                        .select(peewee.fn.MIN(
+                            getattr(Kept, primary_key.name)))
+                        .join(Row, on=functools.reduce(
+                            operator.and_,
+                            [getattr(Kept, field.name)
+                             == getattr(Row, field.name)
+                             for field in fields]))
+                        .where(getattr(Row, primary_key.name) == reference))
+                (ref_model
+                 .update({foreign_key: kept})
+                 .where(foreign_key.not_in(keep))
+                 .execute())
+
+            model.delete().where(primary_key.not_in(keep)).execute()
+
+        return remove
+
+
+def change_triggers(model):
+    """Yield (name, sql) of the triggers counting the writes to the table
+    of model in TableVersion.
+
+    For models with a time field the triggers also keep the earliest time
+    of the written rows in TableVersion.since.
+    """
+    # virtual tables can't have triggers
+    if model is TableVersion or issubclass(model, VirtualModel):
+        return
+
+    table = model._meta.table_name
+    versions = TableVersion._meta.table_name
+    time = model._meta.fields.get('time')
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        name = f'{table}_{operation.lower()}_version'
+        if time is None:
+            yield name, (
+                f'CREATE TRIGGER "{name}" AFTER {operation} ON "{table}" '
+                f'BEGIN INSERT INTO "{versions}" ("name", "version") '
+                f"VALUES ('{table}', 1) ON CONFLICT (\"name\") "
+                f'DO UPDATE SET "version" = "version" + 1; END')
+            continue
+
+        column = time.column_name
+        since = {
+            'INSERT': f'new."{column}"',
+            'UPDATE': f'MIN(old."{column}", new."{column}")',
+            'DELETE': f'old."{column}"',
+        }[operation]
+        yield name, (
+            f'CREATE TRIGGER "{name}" AFTER {operation} ON "{table}" '
+            f'BEGIN INSERT INTO "{versions}" ("name", "version", "since") '
+            f"VALUES ('{table}', 1, {since}) ON CONFLICT (\"name\") "
+            f'DO UPDATE SET "version" = "version" + 1, '
+            f'"since" = MIN(COALESCE("since", excluded."since"), '
+            f'excluded."since"); END')
+
+
+def search_triggers(model):
+    """Yield (name, sql) of the triggers keeping TodoSearch in sync with
+    its external content, the todo table."""
+    if model is not Todo:
+        return
+
+    table = Todo._meta.table_name
+    index = TodoSearch._meta.table_name
+    insert = (f'INSERT INTO "{index}" ("rowid", "text") '
+              f'VALUES (new."todo_id", new."text");')
+    delete = (f'INSERT INTO "{index}" ("{index}", "rowid", "text") '
+              f"VALUES ('delete', old.\"todo_id\", old.\"text\");")
+
+    yield f'{index}_insert', (
+        f'CREATE TRIGGER "{index}_insert" AFTER INSERT ON "{table}" '
+        f'BEGIN {insert} END')
+    # save() writes all columns, OF "text" alone would also fire when a
+    # todo is only toggled or removed
+    yield f'{index}_update', (
+        f'CREATE TRIGGER "{index}_update" AFTER UPDATE OF "text" '
+        f'ON "{table}" WHEN old."text" IS NOT new."text" '
+        f'BEGIN {delete} {insert} END')
+    yield f'{index}_delete', (
+        f'CREATE TRIGGER "{index}_delete" AFTER DELETE ON "{table}" '
+        f'BEGIN {delete} END')
+
+
+def schema_fingerprint(models):
+    """Hash of the target schema, as positive 32 bit integer.
+
+    The fingerprint fits into PRAGMA user_version, so that an up to date
+    database can be recognized without comparing the schema.
+    """
+    digest = hashlib.sha256()
+    for model in models:
+        table = EvolveTable(model)
+        digest.update(table.target_schema.encode())
+        for name, schema in sorted(table.target_indexes.items()):
+            digest.update(schema.encode())
+        for name, schema in sorted(table.target_triggers.items()):
+            digest.update(schema.encode())
+
+    # 0 is the default user_version, so make sure it is never used
+    return int.from_bytes(digest.digest()[:4], 'big') % 0x7fffffff + 1
+
 
 class Evolve:
     def __init__(self, db, models, require_confirm=True):
@@ -100,15 +321,36 @@ class Evolve:
         self.load_tables()
 
         self.evolution_steps = list()
+        self.created_tables = list()
 
     def load_tables(self):
         self.tables = dict()
         for model in self.models:
             self.tables[model._meta.table_name] = EvolveTable(model)
 
+        # tables without model, like the shadow tables of virtual tables,
+        # are left alone
         tables = SqliteSchema.select().where(SqliteSchema.type_ == 'table')
-        for table in tables:
-            self.tables[table.tbl_name].schema = table.sql
+        for entry in tables:
+            table = self.tables.get(entry.tbl_name)
+            if table is not None:
+                table.schema = entry.sql
+
+        # automatic indexes for unique and primary key constraints have no
+        # sql and are maintained by sqlite itself
+        indexes = (SqliteSchema.select()
+                   .where(SqliteSchema.type_ == 'index')
+                   .where(SqliteSchema.sql.is_null(False)))
+        for index in indexes:
+            table = self.tables.get(index.tbl_name)
+            if table is not None:
+                table.indexes[index.name] = index.sql
+
+        triggers = SqliteSchema.select().where(SqliteSchema.type_ == 'trigger')
+        for trigger in triggers:
+            table = self.tables.get(trigger.tbl_name)
+            if table is not None:
+                table.triggers[trigger.name] = trigger.sql
 
     def check_create_tables(self):
         tables_to_create = list()
@@ -119,6 +361,7 @@ class Evolve:
         if tables_to_create:
             def create_tables():
                 self.db.create_tables(tables_to_create)
+                self.created_tables.extend(tables_to_create)
 
             self.evolution_steps.append(create_tables)
             names = [model._meta.table_name for model in tables_to_create]
@@ -127,7 +370,34 @@ class Evolve:
     def check_fields(self):
         for name, table in self.tables.items():
             if table.needs_change():
-                self.evolution_steps.extend(table.check_fields())
+                if table.virtual:
+                    self.evolution_steps.append(
+                        self.recreate_table(table.model))
+                else:
+                    self.evolution_steps.extend(table.check_fields())
+
+    def recreate_table(self, model):
+        """Virtual tables can't be altered, they are created again and
+        rebuilt like new tables."""
+        print(f'recreate table: {model._meta.table_name}')
+
+        def recreate():
+            self.db.drop_tables([model])
+            self.db.create_tables([model])
+            self.created_tables.append(model)
+
+        return recreate
+
+    def check_indexes(self):
+        # indexes of new tables are created together with the table
+        for name, table in self.tables.items():
+            if table.schema is not None:
+                self.evolution_steps.extend(table.check_indexes())
+
+    def check_triggers(self):
+        # after check_create_tables, new tables need their triggers too
+        for name, table in self.tables.items():
+            self.evolution_steps.extend(table.check_triggers())
 
     def user_confirm(self):
         if input("Apply modification y/n? ") == "y":
@@ -138,6 +408,8 @@ class Evolve:
     def evolve(self):
         self.check_create_tables()
         self.check_fields()
+        self.check_indexes()
+        self.check_triggers()
 
         if self.evolution_steps:
             if not self.require_confirm or self.user_confirm():
@@ -148,24 +420,296 @@ class Evolve:
                 exit(0)
 
 
+class EventJournal:
+    """Write-behind queue for inserts into the append only event tables.
+
+    Queries passed to write() are executed by a background thread with its
+    own connection, all writes pending at that point are committed in a
+    single transaction. Anything reading the written tables has to call
+    flush() first to see its own writes. A batch that can't be committed
+    is retried, if it still fails it is dropped and reported to
+    TableChanges, so that the services reload their state.
+    """
+    RETRIES = 3
+    RETRY_DELAY = 0.1
+
+    def __init__(self, database, changes=None):
+        self.database = database
+        self.changes = changes
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name='dotrack-journal', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def write(self, *queries):
+        """Execute queries in the background, in the same transaction."""
+        if self.running():
+            self.queue.put(queries)
+        else:
+            self.flush()
+            with self.database.atomic():
+                for query in queries:
+                    query.execute()
+
+    def flush(self):
+        """Wait until all pending writes are committed.
+
+        Without a running thread the pending writes are executed by the
+        caller instead.
+        """
+        if self.running():
+            self.queue.join()
+            return
+
+        while True:
+            try:
+                queries = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                if queries is not None:
+                    with self.database.atomic():
+                        for query in queries:
+                            query.execute()
+            finally:
+                self.queue.task_done()
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            running = None not in batch
+            try:
+                self.commit([queries for queries in batch
+                             if queries is not None])
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+        self.database.close()
+
+    def commit(self, batch):
+        if not batch:
+            return
+
+        for attempt in range(1, self.RETRIES + 1):
+            try:
+                self.database.connect(reuse_if_open=True)
+                # immediate, so that no other commit falls between the
+                # reads of the versions
+                with self.database.atomic('IMMEDIATE'):
+                    before = self.read_versions()
+                    for queries in batch:
+                        for query in queries:
+                            query.execute()
+                    after = self.read_versions()
+            except Exception:
+                if attempt == self.RETRIES:
+                    traceback.print_exc()
+                else:
+                    time.sleep(self.RETRY_DELAY * attempt)
+            else:
+                if self.changes is not None:
+                    self.changes.record_own(before, after)
+                return
+
+        print(f'journal: dropped {len(batch)} writes after '
+              f'{self.RETRIES} attempts')
+        if self.changes is not None:
+            self.changes.report_failed({query.model for queries in batch
+                                        for query in queries})
+
+    def read_versions(self):
+        if self.changes is None:
+            return dict()
+        return self.changes.read_versions()
+
+
+class TableChanges:
+    """Notices writes to the tables of the models, also by other processes.
+
+    Triggers count the writes per table in TableVersion. poll() only reads
+    the counters if PRAGMA data_version, which changes with commits of
+    other connections (the journal thread, other processes), or the change
+    count of the own connection moved since the last poll. on_changed is
+    called with the set of models whose tables were written, but not for
+    writes of the own connection alone, the services doing them already
+    updated their state. The journal thread reports the versions its commits
+    moved the counters from and to with record_own(), such steps are skipped
+    as well, and the models of writes it dropped with report_failed().
+    """
+
+    def __init__(self, database, models):
+        self.database = database
+        self.models = models
+        self.on_changed = Observable()
+        self.state = None
+        self.versions = dict()
+        # (name, version before) -> version after, of the journal commits
+        self.own = dict()
+        # models of the writes the journal had to drop
+        self.failed = set()
+        self.lock = threading.Lock()
+
+    def read_state(self):
+        return (self.database.pragma('data_version'),
+                self.database.connection().total_changes)
+
+    def read_versions(self):
+        return dict(TableVersion
+                    .select(TableVersion.name, TableVersion.version)
+                    .tuples())
+
+    def take_since(self, model):
+        """Earliest time of the rows of model written since the last call,
+        None if there were none. Only tracked for models with a time field.
+        """
+        name = model._meta.table_name
+        with self.database.atomic('IMMEDIATE'):
+            since = (TableVersion
+                     .select(TableVersion.since)
+                     .where(TableVersion.name == name)
+                     .scalar())
+            if since is not None:
+                (TableVersion
+                 .update(since=None)
+                 .where(TableVersion.name == name)
+                 .execute())
+        return since
+
+    def record_own(self, before, after):
+        """Called by the journal thread after committing, with the versions
+        read at the start and at the end of its transaction."""
+        with self.lock:
+            for name, version in after.items():
+                if before.get(name) != version:
+                    self.own[name, before.get(name)] = version
+
+    def report_failed(self, models):
+        """Called by the journal thread for writes it dropped, the next
+        poll() reports their models as changed."""
+        with self.lock:
+            self.failed.update(models)
+
+    def skip_own(self, name, old, new):
+        """Follow the journal commits from version old, True if they
+        explain all writes up to version new."""
+        with self.lock:
+            while old != new and (name, old) in self.own:
+                old = self.own.pop((name, old))
+        return old == new
+
+    def reset(self):
+        self.state = self.read_state()
+        self.versions = self.read_versions()
+        with self.lock:
+            self.own.clear()
+            self.failed.clear()
+
+    def poll(self, dt=None):
+        with self.lock:
+            failed, self.failed = self.failed, set()
+        state = self.read_state()
+        if state == self.state:
+            if failed:
+                self.on_changed(failed)
+            return
+
+        external = state[0] != self.state[0]
+        self.state = state
+        versions = self.read_versions()
+        changed = {name for name, version in versions.items()
+                   if self.versions.get(name) != version}
+        if external:
+            changed = {name for name in changed
+                       if not self.skip_own(name, self.versions.get(name),
+                                            versions[name])}
+        self.versions = versions
+        with self.lock:
+            # commits recorded only after a poll already saw them
+            self.own = {(name, old): new
+                        for (name, old), new in self.own.items()
+                        if old is not None and old >= versions.get(name, 0)}
+        models = failed
+        if external:
+            models |= {model for model in self.models()
+                       if model._meta.table_name in changed}
+        if models:
+            self.on_changed(models)
+
+
 class DatabaseManger:
     SAVE_FILE = BASE_DIR / '../data/dotrack.db'
 
     def __init__(self):
-        self.db = peewee.SqliteDatabase(None)
+        self.db = MonitoredDatabase(None)
+        self.changes = TableChanges(self.db, self.models)
+        self.journal = EventJournal(self.db, self.changes)
 
     def connect(self):
         exists = self.SAVE_FILE.exists()
-        self.db.init(str(self.SAVE_FILE))
-        self.db.connect()
-        evolve = Evolve(self.db, self.models(), require_confirm=exists)
-        evolve.evolve()
-
-        EventType.init_events()
-        ExpType.init_events()
+        name_registry.clear()
+        identity_map.clear()
+        # wal mode, so that reads are not blocked by the journal thread
+        self.db.init(str(self.SAVE_FILE), pragmas={'journal_mode': 'wal'})
+        with startup.span('db connect'):
+            self.db.connect()
+
+        with startup.span('schema check'):
+            fingerprint = schema_fingerprint(self.models())
+            up_to_date = self.db.pragma('user_version') == fingerprint
+
+            if not up_to_date:
+                with startup.span('evolve'):
+                    evolve = Evolve(self.db, self.models(),
+                                    require_confirm=exists)
+                    evolve.evolve()
+
+            EventType.init_events()
+            ExpType.init_events()
+
+            if not up_to_date:
+                # user_version is only written after the backfill, so an
+                # interrupted one is retried on the next start
+                if (WorkSession in evolve.created_tables
+                        or WorkSession.needs_backfill()):
+                    WorkSession.rebuild()
+                if ExpLedger in evolve.created_tables:
+                    ExpLedger.rebuild()
+                if TodoSearch in evolve.created_tables:
+                    TodoSearch.rebuild()
+
+                self.db.pragma('user_version', fingerprint)
+
+        self.journal.start()
+        self.changes.reset()
+
+    def close(self):
+        self.journal.stop()
+        self.db.close()
 
     def models(self):
-        return [Todo, EventType, Event, ExpType, ExpEvent, TaskGroup]
+        return [Todo, EventType, Event, ExpType, ExpEvent, ExpLedger,
+                TaskGroup, WorkSession, TableVersion, TodoSearch]
 
     def __call__(self):
         return self.db
@@ -187,6 +731,17 @@ class SqliteSchema(peewee.Model):
         primary_key = False
 
 
+class TableVersion(peewee.Model):
+    """Write counter per table, maintained by the change_triggers."""
+    name = peewee.TextField(primary_key=True)
+    version = peewee.IntegerField(default=0)
+    # earliest time of the rows written since the last take_since()
+    since = peewee.DateTimeField(null=True)
+
+    class Meta:
+        database = db()
+
+
 @Config.register
 @dataclass
 class TodoServiceSettings:
@@ -200,17 +755,148 @@ class TodoServiceState:
     selected_todo: Optional[int] = None
 
 
+@dataclass
+class TodoCounts:
+    """Todos of a task group, deleted ones are not counted."""
+    open: int = 0
+    done_recently: int = 0
+    """Done todos that are still displayed."""
+    total: int = 0
+
+
 def find(elements, value, key, default):
     return next((x for x in elements if key(x) == value), default)
 
 
+def fold_sessions(events):
+    """Pair START and STOP events (ordered by time) into (start, stop).
+
+    A START that is not followed by a STOP yields (start, None), a STOP
+    without preceding START is ignored. Like in the reports, a STOP ends
+    the preceding START even if it was logged for another todo, which
+    edited events can cause.
+    """
+    events = iter(events)
+    try:
+        start = None
+        while True:
+            nxt = next(events)
+            if nxt.event_type_id == EventType.START.event_type_id:
+                if start is not None:
+                    yield start, None
+                start = nxt
+            elif nxt.event_type_id == EventType.STOP.event_type_id:
+                if start is not None:
+                    yield start, nxt
+                    start = None
+                else:
+                    continue
+
+    except StopIteration:
+        if start is not None:
+            yield start, None
+
+
+def iter_sessions(events):
+    """Turn START and STOP events into (todo_id, start, end) tuples.
+
+    Follows fold_sessions, a START without STOP lasts until the next START,
+    the last one is still open and has end None.
+    """
+    pending = None
+    for start, stop in fold_sessions(events):
+        if pending is not None:
+            yield pending.todo_id, pending.time, start.time
+
+        if stop is None:
+            pending = start
+        else:
+            pending = None
+            yield start.todo_id, start.time, stop.time
+
+    if pending is not None:
+        yield pending.todo_id, pending.time, None
+
+
+def split_days(start, end):
+    """Split the interval from start to end at midnight."""
+    while start.date() < end.date():
+        midnight = datetime.datetime.combine(
+            start.date() + datetime.timedelta(days=1), datetime.time())
+        yield start, midnight
+        start = midnight
+
+    if start < end:
+        yield start, end
+
+
+def start_of_day(date):
+    return datetime.datetime.combine(date, datetime.time())
+
+
+class WorkTime:
+    """Work time of today, maintained incrementally.
+
+    Today's sessions are only read on the first access of the day and on
+    reload(), afterwards the value is updated through on_start and on_stop.
+    A START without matching STOP counts until the next START.
+    """
+
+    def __init__(self):
+        self.day = None
+        self.closed = datetime.timedelta()
+        self.open_start = None
+
+    def reload(self):
+        today = datetime.date.today()
+        begin = start_of_day(today)
+        end = start_of_day(today + datetime.timedelta(days=1))
+
+        db.journal.flush()
+        self.day = today
+        self.closed = WorkSession.total(
+            WorkSession.in_range(begin, end)
+            .where(WorkSession.end.is_null(False)),
+            begin, end)
+
+        session = WorkSession.get_open()
+        if session is None:
+            self.open_start = None
+        else:
+            self.open_start = max(session.start, begin)
+
+    def on_start(self, time):
+        if self.open_start is not None:
+            self.closed += time - self.open_start
+        self.open_start = time
+
+    def on_stop(self, time):
+        if self.open_start is not None:
+            self.closed += time - self.open_start
+            self.open_start = None
+
+    def value(self):
+        now = datetime.datetime.now()
+        if self.day != now.date():
+            self.reload()
+
+        if self.open_start is None:
+            return self.closed
+        else:
+            return self.closed + (now - self.open_start)
+
+
 @injectable("application")
-class TodoService(Injectable):
+class TodoService(Injectable, Subscriber):
+    DONE_DISPLAY_TIME = datetime.timedelta(minutes=1)
+    SEARCH_LIMIT = 20
+
     @dataclass
     class Dependencies(Injectable.Dependencies):
         config: Config
         save: SaveState
 
+    @startup.timed
     def on_init(self):
         super().on_init()
 
@@ -219,8 +905,15 @@ class TodoService(Injectable):
 
         self.on_selected_changed = Observable()
         self.on_todo_toggle = Observable()
+        self.on_events_changed = Observable()
+        self.on_todos_changed = Observable()
+
+        self.subscribe('on_changed', db.changes, self.on_tables_changed)
 
         self._selected = None
+        self._todos = None
+        self._counts = None
+        self._counts_expire = None
 
         groups = self.config[TodoServiceSettings].task_groups
         self.task_groups = TaskGroup.get_groups(groups)
@@ -238,10 +931,9 @@ class TodoService(Injectable):
                     default=None)
         self.selected = task
 
-        Event.create(
-            todo=None,
-            event_type=EventType.APP_START,
-            time=datetime.datetime.now())
+        self.work_time_tracker = WorkTime()
+        self.open_session = WorkSession.get_open()
+        self.log_event(None, EventType.APP_START)
 
     def select_group(self, group):
         if self.selected_group is not None:
@@ -249,6 +941,8 @@ class TodoService(Injectable):
 
         group.selected = True
         self.selected_group = group
+        self.save[TodoServiceState].selected_group = group.name
+        self.invalidate_todos()
 
     @property
     def selected(self):
@@ -258,33 +952,124 @@ class TodoService(Injectable):
     def selected(self, value):
         self.on_selected_changed(value)
         self._selected = value
-
-    def on_destroy(self):
-        self.save[TodoServiceState].selected_group = self.selected_group.name
-        if self.selected is not None:
-            self.save[TodoServiceState].selected_todo = self.selected.todo_id
+        if value is not None:
+            self.save[TodoServiceState].selected_todo = value.todo_id
         else:
             self.save[TodoServiceState].selected_todo = None
 
-        Event.create(
-            todo=None,
-            event_type=EventType.APP_STOP,
-            time=datetime.datetime.now())
+    def on_destroy(self):
+        self.log_event(None, EventType.APP_STOP)
+        db.close()
+
+        clock.unschedule(self.invalidate_todos)
+        self.cancel_subscriptions()
 
         super().on_destroy()
 
     @property
     def todos(self):
-        display_time = (datetime.datetime.now()
-                        - datetime.timedelta(minutes=1))
+        if self._todos is None:
+            self._todos = self.load_todos()
+        return self._todos
+
+    def load_todos(self):
+        now = datetime.datetime.now()
+        display_time = now - self.DONE_DISPLAY_TIME
+        todos = identity_map.load(
+            self.visible_todos(self.selected_group, display_time))
+
+        # done todos are only displayed for a while, so the result is
+        # outdated as soon as the first of them drops out of the window
+        done = [todo.done for todo in todos if todo.done is not None]
+        if done:
+            expires = min(done) + self.DONE_DISPLAY_TIME - now
+            clock.schedule_once(self.invalidate_todos,
+                                max(0., expires.total_seconds()))
+
+        return todos
+
+    def on_tables_changed(self, models):
+        if Todo in models:
+            self._counts = None
+            self.invalidate_todos()
+
+        if models & {Event, WorkSession}:
+            db.journal.flush()
+            if Event in models:
+                # sessions are derived from the events, redo them from the
+                # earliest event that was written elsewhere
+                since = db.changes.take_since(Event)
+                if since is not None:
+                    WorkSession.rebuild(since=since)
+            self.open_session = WorkSession.get_open()
+            self.work_time_tracker.reload()
+            self.on_events_changed()
+
+    @property
+    def counts(self):
+        """TodoCounts by task group id.
+
+        Loaded with a single query and afterwards maintained by add, remove
+        and toggle_done, only reloaded when done todos drop out of the
+        display time or the todos were changed elsewhere.
+        """
+        if (self._counts is None
+                or (self._counts_expire is not None
+                    and datetime.datetime.now() >= self._counts_expire)):
+            self._counts = self.load_counts()
+        return self._counts
+
+    def load_counts(self):
+        now = datetime.datetime.now()
+        recent = Todo.done > now - self.DONE_DISPLAY_TIME
+        query = (Todo
+                 .select(Todo.group,
+                         peewee.fn.COUNT(Todo.todo_id).filter(
+                             Todo.done.is_null()),
+                         peewee.fn.COUNT(Todo.todo_id).filter(recent),
+                         peewee.fn.COUNT(Todo.todo_id),
+                         peewee.fn.MIN(Todo.done).filter(recent))
+                 .where(~Todo.deleted)
+                 .group_by(Todo.group))
+
+        counts = dict()
+        first_done = list()
+        for group_id, open, done_recently, total, done in query.tuples():
+            counts[group_id] = TodoCounts(open, done_recently, total)
+            if done is not None:
+                first_done.append(Todo.done.python_value(done))
+
+        if first_done:
+            self._counts_expire = min(first_done) + self.DONE_DISPLAY_TIME
+        else:
+            self._counts_expire = None
+        return counts
+
+    def group_counts(self, group):
+        return self.counts.setdefault(group.task_group_id, TodoCounts())
+
+    def update_counts(self, group_id, **changes):
+        if self._counts is None:
+            return
+
+        counts = self._counts.setdefault(group_id, TodoCounts())
+        for name, change in changes.items():
+            setattr(counts, name, getattr(counts, name) + change)
+
+    @staticmethod
+    def visible_todos(group, display_time):
+        """Query of the todos of group that are open or were done after
+        display_time."""
         return (Todo
                 .select()
                 .where(~Todo.deleted)
-                .where(
-                    (Todo.done.is_null())
-                    | (Todo.done > display_time))
-                .where(Todo.group == self.selected_group)
-                )
+                .where((Todo.done.is_null()) | (Todo.done > display_time))
+                .where(Todo.group == group))
+
+    def invalidate_todos(self, dt=None):
+        clock.unschedule(self.invalidate_todos)
+        self._todos = None
+        self.on_todos_changed()
 
     def select(self, item):
         if self.is_selected(item):
@@ -293,52 +1078,45 @@ class TodoService(Injectable):
             self.selected = item
 
     def work_time(self):
-        today = datetime.date.today()
-        end_of_today = today + datetime.timedelta(days=1)
-
-        events = (
-            Event.select()
-            .where((today <= Event.time) & (Event.time < end_of_today))
-            .where((Event.event_type == EventType.START)
-                   | (Event.event_type == EventType.STOP))
-            .order_by(Event.time)
-        )
-
-        def fold(events):
-            events = iter(events)
-            try:
-                start = None
-                while True:
-                    nxt = next(events)
-                    if nxt.event_type == EventType.START:
-                        if start is not None:
-                            yield start, None
-                        start = nxt
-                    elif nxt.event_type == EventType.STOP:
-                        if start is not None:
-                            assert start.todo_id == nxt.todo_id
-                            assert start.time < nxt.time
-                            yield start, nxt
-                            start = None
-                        else:
-                            continue
-
-            except StopIteration:
-                if start is not None:
-                    yield start, None
-
-        last_time = datetime.datetime.now()
-        work_time = datetime.timedelta()
+        return self.work_time_tracker.value()
+
+    def log_event(self, todo, event_type):
+        now = datetime.datetime.now()
+        queries = [Event.insert(
+            todo=todo,
+            event_type=event_type,
+            time=now)]
+
+        if event_type == EventType.START:
+            queries.extend(self.close_session(now))
+            queries.append(WorkSession.insert(todo=todo, start=now))
+            self.open_session = WorkSession(todo=todo, start=now)
+            self.work_time_tracker.on_start(now)
+        elif event_type == EventType.STOP:
+            queries.extend(self.close_session(now))
+            self.work_time_tracker.on_stop(now)
+
+        db.journal.write(*queries)
+        self.on_events_changed()
+
+    def close_session(self, time):
+        session = self.open_session
+        if session is None:
+            return []
+
+        self.open_session = None
+        return WorkSession.close(session, time)
+
+    def event_edited(self, event, old_time):
+        db.journal.flush()
+        WorkSession.rebuild(since=min(old_time, event.time))
+        self.open_session = WorkSession.get_open()
 
-        for start, stop in reversed(list(fold(events))):
-            if stop is None:
-                duration = last_time - start.time
-            else:
-                duration = stop.time - start.time
-            work_time += duration
-            last_time = start.time
+        today = datetime.date.today()
+        if old_time.date() == today or event.time.date() == today:
+            self.work_time_tracker.reload()
 
-        return work_time
+        self.on_events_changed()
 
     def is_selected(self, item):
         if self.selected is None:
@@ -346,19 +1124,58 @@ class TodoService(Injectable):
         else:
             return self.selected.todo_id == item.todo_id
 
+    def search(self, text, group=None, limit=SEARCH_LIMIT):
+        """Todos with words starting with each word of text, best matches
+        first. Done and deleted todos are included."""
+        words = re.findall(r'\w+', text)
+        if not words:
+            return []
+
+        # quoted, so that words like AND or NOT are not operators. Single
+        # characters are too common to rank all todos starting with them.
+        term = ' '.join(f'"{word}"*' if len(word) > 1 else f'"{word}"'
+                        for word in words)
+        query = (Todo
+                 .select()
+                 .join(TodoSearch, on=(TodoSearch.rowid == Todo.todo_id))
+                 .where(TodoSearch.match(term))
+                 .order_by(TodoSearch.rank())
+                 .limit(limit))
+        if group is not None:
+            query = query.where(Todo.group == group)
+
+        return identity_map.load(query)
+
+    def is_done_recently(self, item):
+        display_time = datetime.datetime.now() - self.DONE_DISPLAY_TIME
+        return item.done is not None and item.done > display_time
+
     def add(self, text):
         Todo.create(text=text, group=self.selected_group)
+        self.update_counts(self.selected_group.task_group_id,
+                           open=1, total=1)
+        self.invalidate_todos()
 
     def remove(self, item):
         item.deleted = True
         item.save()
+        self.update_counts(item.group_id, total=-1,
+                           open=-(item.done is None),
+                           done_recently=-self.is_done_recently(item))
+        self.invalidate_todos()
 
     def toggle_done(self, item):
         if item.done is None:
             item.done = datetime.datetime.now()
+            self.update_counts(item.group_id, open=-1, done_recently=1)
+            if self._counts_expire is None:
+                self._counts_expire = item.done + self.DONE_DISPLAY_TIME
         else:
+            self.update_counts(item.group_id, open=1,
+                               done_recently=-self.is_done_recently(item))
             item.done = None
         item.save()
+        self.invalidate_todos()
 
         self.on_todo_toggle(item)
 
@@ -411,6 +1228,7 @@ class Timer(Injectable, Subscriber):
         config: Config
         save: SaveState
 
+    @startup.timed
     def on_init(self):
         super().on_init()
         self.subscribe('on_selected_changed', self.todo_service)
@@ -458,10 +1276,7 @@ class Timer(Injectable, Subscriber):
             todo = self.selected
 
         if todo is not None:
-            Event.create(
-                todo=todo,
-                event_type=EventType.START,
-                time=datetime.datetime.now())
+            self.todo_service.log_event(todo, EventType.START)
 
     def stop(self):
         if not self.is_active() or not self.is_running():
@@ -471,10 +1286,7 @@ class Timer(Injectable, Subscriber):
 
         selected = self.selected
         if selected is not None:
-            Event.create(
-                todo=selected,
-                event_type=EventType.STOP,
-                time=datetime.datetime.now())
+            self.todo_service.log_event(selected, EventType.STOP)
 
     def reset(self):
         self.stop()
@@ -498,9 +1310,15 @@ class ExpService(Injectable, Subscriber):
         todo: TodoService
         timer: Timer
 
+    @startup.timed
     def on_init(self):
         self.subscribe('on_todo_toggle', self.todo)
         self.subscribe('on_reset', self.timer, self.on_timer_reset)
+        self.subscribe('on_changed', db.changes, self.on_tables_changed)
+
+        self.set_ledger(ExpLedger.load())
+        # checking the ledger needs a full scan, don't delay startup for it
+        startup.after_first_frame(self.verify_ledger)
 
     def on_destroy(self):
         self.cancel_subscriptions()
@@ -514,15 +1332,7 @@ class ExpService(Injectable, Subscriber):
         return self.exp / self.next_level
 
     def raw_exp(self):
-        value = (
-            ExpEvent
-            .select(peewee.fn.Sum(ExpEvent.exp))
-            .scalar()
-        )
-        if value is None:
-            return 0
-        else:
-            return value
+        return self.total
 
     @property
     def exp(self):
@@ -532,49 +1342,177 @@ class ExpService(Injectable, Subscriber):
     def level(self):
         return self.raw_exp() // exp_table['exp_per_level'] + 1
 
+    def set_ledger(self, ledger):
+        self.ledger = ledger
+        self.total = sum(self.ledger.values())
+
+    def on_tables_changed(self, models):
+        if models & {ExpEvent, ExpLedger}:
+            db.journal.flush()
+            if ExpEvent in models:
+                # exp events written elsewhere may not have been booked
+                ExpLedger.rebuild()
+            self.set_ledger(ExpLedger.load())
+
+    def verify_ledger(self):
+        self.set_ledger(ExpLedger.verify())
+
+    def book(self, exp_type, exp):
+        """Record an exp change in the in-memory view of the ledger.
+
+        Has to be called after the change was written to the database.
+        """
+        type_id = exp_type.exp_type_id
+        self.ledger[type_id] = self.ledger.get(type_id, 0) + exp
+        self.total += exp
+
+    def add_exp(self, exp_type, exp, todo=None):
+        db.journal.write(
+            ExpEvent.insert(
+                exp=exp,
+                event_type=exp_type,
+                time=datetime.datetime.now(),
+                todo=todo
+            ),
+            ExpLedger.add(exp_type, exp)
+        )
+
+        self.book(exp_type, exp)
+
+    def remove_exp(self, exp_type, todo):
+        db.journal.flush()
+        with db().atomic():
+            exp = (ExpEvent
+                   .select(peewee.fn.Sum(ExpEvent.exp))
+                   .where(ExpEvent.todo == todo)
+                   .where(ExpEvent.event_type == exp_type)
+                   .scalar())
+            if exp is None:
+                return
+
+            (ExpEvent
+                .delete()
+                .where(ExpEvent.todo == todo)
+                .where(ExpEvent.event_type == exp_type)
+                .execute())
+            ExpLedger.add(exp_type, -exp).execute()
+
+        self.book(exp_type, -exp)
+
     def on_timer_reset(self, remaining):
         if remaining < 0:
-            ExpEvent.create(
-                exp=exp_table['raw_exp']['reset'],
-                event_type=ExpType.RESET,
-                time=datetime.datetime.now(),
-            )
+            self.add_exp(ExpType.RESET, exp_table['raw_exp']['reset'])
 
     def on_todo_toggle(self, item):
         if item.done:
-            ExpEvent.create(
-                exp=exp_table['raw_exp']['toggle'],
-                event_type=ExpType.DONE,
-                time=datetime.datetime.now(),
-                todo=item
-            )
+            self.add_exp(ExpType.DONE, exp_table['raw_exp']['toggle'],
+                         todo=item)
         else:
-            (ExpEvent
-                .delete()
-                .where(ExpEvent.todo == item)
-                .where(ExpEvent.event_type == ExpType.DONE)
-                .execute())
+            self.remove_exp(ExpType.DONE, item)
 
 
-def get_or_create_by_name(names, model):
-    names = set(names)
-    result = list()
+class NameRegistry:
+    """Process wide map from names to ids for models with unique names.
+
+    Filled by get_or_create_by_name, so that names of types and groups
+    can be resolved without a query after they were seen once. Cleared
+    when the database is connected.
+    """
+
+    def __init__(self):
+        self.ids = dict()
+
+    def clear(self):
+        self.ids = dict()
+
+    def add(self, model, entries):
+        ids = self.ids.setdefault(model, dict())
+        for entry in entries:
+            ids[entry.name] = entry.get_id()
+
+    def get_id(self, model, name):
+        if isinstance(name, Enum):
+            name = name.value
+
+        try:
+            return self.ids[model][name]
+        except KeyError:
+            return get_or_create_by_name([name], model)[0].get_id()
+
+
+name_registry = NameRegistry()
+
 
-    for entry in model.select():
-        if entry.name in names:
-            result.append(entry)
-            names.discard(entry.name)
+class IdentityMap:
+    """One canonical instance per model and primary key.
 
-    for name in names:
-        entry = model.create(name=name)
-        result.append(entry)
+    Rows loaded through load() update the known instance of their key in
+    place instead of creating a new one, so that state kept on instances,
+    like selected, survives reloads and components see the same object
+    for the same row. Instances are only kept while they are referenced.
+    """
 
+    def __init__(self):
+        self.instances = dict()
+
+    def clear(self):
+        self.instances = dict()
+
+    def hydrate(self, model, **data):
+        instances = self.instances.setdefault(
+            model, weakref.WeakValueDictionary())
+        key = data[model._meta.primary_key.name]
+        instance = instances.get(key)
+        if instance is None:
+            instance = model(__no_default__=1, **data)
+            instances[key] = instance
+        else:
+            for name, value in data.items():
+                setattr(instance, name, value)
+        instance._dirty.clear()
+        return instance
+
+    def load(self, query):
+        """Canonical instances of the rows of a model select query."""
+        return list(query.objects(
+            functools.partial(self.hydrate, query.model)))
+
+
+identity_map = IdentityMap()
+
+
+def get_or_create_by_name(names, model):
+    """Entries of model with the given names, in the same order.
+
+    Only the missing names are inserted, relies on the unique index on
+    name.
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return []
+
+    entries = {entry.name: entry
+               for entry in identity_map.load(
+                   model.select().where(model.name.in_(names)))}
+
+    missing = [name for name in names if name not in entries]
+    if missing:
+        (model
+         .insert_many([(name,) for name in missing], fields=[model.name])
+         .on_conflict_ignore()
+         .execute())
+        entries.update((entry.name, entry)
+                       for entry in identity_map.load(
+                           model.select().where(model.name.in_(missing))))
+
+    result = [entries[name] for name in names]
+    name_registry.add(model, result)
     return result
 
 
 class TaskGroup(peewee.Model):
     task_group_id = peewee.AutoField(primary_key=True)
-    name = peewee.TextField()
+    name = peewee.TextField(unique=True)
 
     class Meta:
         database = db()
@@ -593,19 +1531,42 @@ class Todo(peewee.Model):
     text = peewee.TextField()
     done = peewee.DateTimeField(null=True)
     deleted = peewee.BooleanField(default=False)
-    group = peewee.ForeignKeyField(TaskGroup)
+    group = peewee.ForeignKeyField(TaskGroup, index=False)
 
     class Meta:
         database = db()
+        indexes = (
+            (('group', 'deleted', 'done'), False),
+        )
 
     def __init__(self, **kwargs):
         self.selected = False
         super().__init__(**kwargs)
 
 
+class TodoSearch(FTS5Model):
+    """Full text index of Todo.text, kept in sync by the search_triggers.
+
+    The text is only stored in the todo table. Prefixes of two and three
+    characters are indexed, so that prefix queries of short words typed so
+    far don't need to scan the terms.
+    """
+    rowid = RowIDField()
+    text = SearchField()
+
+    class Meta:
+        database = db()
+        options = {
+            'content': Todo,
+            'content_rowid': Todo.todo_id,
+            'prefix': '2 3',
+            'tokenize': 'unicode61 remove_diacritics 2',
+        }
+
+
 class ExpType(peewee.Model):
     exp_type_id = peewee.AutoField(primary_key=True)
-    name = peewee.TextField()
+    name = peewee.TextField(unique=True)
 
     class Meta:
         database = db()
@@ -630,15 +1591,88 @@ class ExpEvent(peewee.Model):
     exp = peewee.IntegerField()
     event_type = peewee.ForeignKeyField(ExpType)
     time = peewee.DateTimeField()
-    todo = peewee.ForeignKeyField(Todo, null=True, backref='exp_events')
+    todo = peewee.ForeignKeyField(Todo, null=True, backref='exp_events',
+                                  index=False)
+
+    class Meta:
+        database = db()
+        indexes = (
+            (('todo', 'event_type'), False),
+        )
+
+
+class ExpLedger(peewee.Model):
+    """Running total of ExpEvent.exp per exp type.
+
+    Kept in sync with ExpEvent by ExpService, so the total exp can be read
+    without aggregating over the full history.
+    """
+
+    event_type = peewee.ForeignKeyField(ExpType, primary_key=True)
+    exp = peewee.IntegerField(default=0)
 
     class Meta:
         database = db()
 
+    @classmethod
+    def add(cls, exp_type, exp):
+        return (cls
+                .insert(event_type=exp_type, exp=exp)
+                .on_conflict(
+                    conflict_target=[cls.event_type],
+                    update={cls.exp: cls.exp + exp}))
+
+    @classmethod
+    def load(cls):
+        """Load the ledger as dict from exp type id to exp."""
+        db.journal.flush()
+        return {
+            type_id: exp
+            for type_id, exp in (cls
+                                 .select(cls.event_type, cls.exp)
+                                 .where(cls.exp != 0)
+                                 .tuples())
+        }
+
+    @classmethod
+    def verify(cls):
+        """Check the ledger against the actual sum over ExpEvent.
+
+        The ledger is rebuilt if they do not match, returns the verified
+        ledger like load().
+        """
+        ledger = cls.load()
+        actual = {
+            type_id: exp
+            for type_id, exp in (ExpEvent
+                                 .select(ExpEvent.event_type,
+                                         peewee.fn.Sum(ExpEvent.exp))
+                                 .group_by(ExpEvent.event_type)
+                                 .tuples())
+            if exp
+        }
+
+        if ledger != actual:
+            print('exp ledger out of sync, rebuilding')
+            cls.rebuild()
+
+        return actual
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute the ledger from ExpEvent."""
+        with cls._meta.database.atomic():
+            cls.delete().execute()
+            cls.insert_from(
+                ExpEvent
+                .select(ExpEvent.event_type, peewee.fn.Sum(ExpEvent.exp))
+                .group_by(ExpEvent.event_type),
+                fields=[cls.event_type, cls.exp]).execute()
+
 
 class EventType(peewee.Model):
     event_type_id = peewee.AutoField(primary_key=True)
-    name = peewee.TextField()
+    name = peewee.TextField(unique=True)
 
     class Meta:
         database = db()
@@ -660,18 +1694,176 @@ class EventType(peewee.Model):
 class Event(peewee.Model):
     event_id = peewee.AutoField(primary_key=True)
     todo = peewee.ForeignKeyField(Todo, backref='events', null=True)
-    event_type = peewee.ForeignKeyField(EventType)
+    event_type = peewee.ForeignKeyField(EventType, index=False)
     time = peewee.DateTimeField()
 
     class Meta:
         database = db()
+        indexes = (
+            (('time', 'event_type'), False),
+        )
+
+
+class WorkSession(peewee.Model):
+    """Work interval on a todo, derived from START and STOP events.
+
+    Sessions never extend over midnight, longer ones are split, so that
+    sessions overlapping a day can be found by the index on start. The
+    currently running session has end None.
+    """
+
+    work_session_id = peewee.AutoField(primary_key=True)
+    todo = peewee.ForeignKeyField(Todo, backref='work_sessions')
+    start = peewee.DateTimeField(index=True)
+    end = peewee.DateTimeField(null=True, index=True)
+
+    class Meta:
+        database = db()
+
+    BATCH_SIZE = 1000
+
+    @classmethod
+    def get_open(cls):
+        return cls.select().where(cls.end.is_null()).first()
+
+    @classmethod
+    def close(cls, session, end):
+        """Queries closing the open session at end."""
+        days = list(split_days(session.start, end))
+        if not days:
+            days = [(session.start, end)]
+
+        queries = [cls.update(end=days[0][1]).where(cls.end.is_null())]
+        for day_start, day_end in days[1:]:
+            queries.append(
+                cls.insert(todo=session.todo_id, start=day_start, end=day_end))
+
+        return queries
+
+    @classmethod
+    def rebuild(cls, since=None):
+        """Recreate the sessions from all events at or after since.
+
+        The sessions are streamed and inserted in batches, so this can be
+        used to backfill the full history. Everything happens in a single
+        transaction, a failed rebuild leaves the old sessions.
+        """
+        events = (
+            Event.select()
+            .where((Event.event_type == EventType.START)
+                   | (Event.event_type == EventType.STOP))
+            .order_by(Event.time, Event.event_id))
+
+        if since is not None:
+            last = events.where(Event.time < since).order_by(
+                Event.time.desc(), Event.event_id.desc()).first()
+            if (last is not None
+                    and last.event_type_id == EventType.START.event_type_id):
+                since = last.time
+            events = events.where(Event.time >= since)
+
+        def rows():
+            for todo_id, start, end in iter_sessions(events.iterator()):
+                if end is None:
+                    yield todo_id, start, end
+                else:
+                    for start, end in split_days(start, end):
+                        yield todo_id, start, end
+
+        with cls._meta.database.atomic():
+            query = cls.delete()
+            if since is not None:
+                query = query.where(cls.start >= since)
+            query.execute()
+
+            for batch in peewee.chunked(rows(), cls.BATCH_SIZE):
+                cls.insert_many(
+                    batch, fields=[cls.todo, cls.start, cls.end]).execute()
+
+    @classmethod
+    def needs_backfill(cls):
+        """True if there are sessions to derive, but none were yet."""
+        return (not cls.select().exists()
+                and Event.select()
+                .where(Event.event_type == EventType.START)
+                .exists())
+
+    @classmethod
+    def in_range(cls, begin, end):
+        """Sessions overlapping the interval from begin to end."""
+        return (cls.select()
+                .where(((cls.start >= start_of_day(begin.date()))
+                        & (cls.start < end))
+                       | cls.end.is_null()))
+
+    @classmethod
+    def seconds(cls, begin, end):
+        """Expression for the seconds a session lies within begin and end."""
+        now = datetime.datetime.now()
+        session_end = peewee.fn.MIN(peewee.fn.COALESCE(cls.end, now), end)
+        session_start = peewee.fn.MAX(cls.start, begin)
+        seconds = (peewee.fn.julianday(session_end)
+                   - peewee.fn.julianday(session_start)) * 86400
+        return peewee.fn.MAX(seconds, 0)
+
+    @classmethod
+    def total(cls, query, begin, end):
+        seconds = (query
+                   .select(peewee.fn.SUM(cls.seconds(begin, end)))
+                   .scalar())
+        return datetime.timedelta(seconds=seconds or 0)
+
+    @classmethod
+    def per_day(cls, begin, end):
+        """List of (date, seconds) of the days with work, ordered by date.
+
+        Closed sessions never extend over midnight, the open one is split
+        at midnight here.
+        """
+        # without coerce, peewee would convert the date to a datetime
+        day = peewee.fn.date(cls.start).coerce(False)
+        seconds = peewee.fn.SUM(cls.seconds(begin, end))
+        closed = (cls.in_range(begin, end)
+                  .where(cls.end.is_null(False))
+                  .select(day, seconds)
+                  .group_by(day)
+                  .tuples())
+
+        totals = {datetime.date.fromisoformat(day): seconds
+                  for day, seconds in closed}
+
+        session = cls.get_open()
+        if session is not None:
+            now = datetime.datetime.now()
+            for start, stop in split_days(max(session.start, begin),
+                                          min(now, end)):
+                totals[start.date()] = (totals.get(start.date(), 0)
+                                        + (stop - start).total_seconds())
+
+        return sorted((day, seconds) for day, seconds in totals.items()
+                      if seconds > 0)
+
+    @classmethod
+    def per_todo(cls, begin, end):
+        seconds = peewee.fn.SUM(cls.seconds(begin, end))
+        return (cls.in_range(begin, end)
+                .select(cls.todo, seconds.alias('seconds'))
+                .group_by(cls.todo))
+
+    @classmethod
+    def per_group(cls, begin, end):
+        seconds = peewee.fn.SUM(cls.seconds(begin, end))
+        return (cls.in_range(begin, end)
+                .select(Todo.group, seconds.alias('seconds'))
+                .join(Todo)
+                .group_by(Todo.group))
 
 
-@injectable("event_list")
+@injectable("application")
 class EventEditService(Injectable):
     @dataclass
     class Dependencies(Injectable.Dependencies):
-        pass
+        todo_service: TodoService
 
     def on_init(self):
         self.reset()
@@ -682,8 +1874,10 @@ class EventEditService(Injectable):
 
     def write_edit(self, event, value):
         assert self.edit_event_id == event.event_id
+        old_time = event.time
         event.time = datetime.datetime.fromisoformat(value)
         event.save()
+        self.todo_service.event_edited(event, old_time)
         self.reset()
 
     def set_edit(self, event, value):
@@ -695,3 +1889,165 @@ class EventEditService(Injectable):
             return self.edit
         else:
             return None
+
+
+@injectable("application")
+class EventHistory(Injectable, Subscriber):
+    """Pages through the todo events, newest first.
+
+    Pages are loaded with keyset pagination on (time, event_id), so the cost
+    of a page does not depend on how far back it is. Besides the visible page
+    up to PREFETCH pages in both directions are kept, the loaded rows are
+    reused until events are inserted or edited. Lives as long as the
+    application, so the list keeps its position when it is opened again.
+    """
+
+    PAGE_SIZE = 15
+    PREFETCH = 1
+
+    @dataclass
+    class Dependencies(Injectable.Dependencies):
+        todo_service: TodoService
+
+    def on_init(self):
+        self.subscribe('on_events_changed', self.todo_service,
+                       self.invalidate)
+
+        # key of the first visible event, None to show the newest events
+        self.anchor = None
+        self.invalidate()
+
+    def on_destroy(self):
+        self.cancel_subscriptions()
+
+    def invalidate(self):
+        self.rows = None
+        self.offset = 0
+        self.at_newest = False
+        self.at_oldest = False
+
+    @staticmethod
+    def key(event):
+        return event.time, event.event_id
+
+    @staticmethod
+    def query():
+        return (Event
+                .select(Event, EventType, Todo)
+                .where(Event.todo_id.is_null(False))
+                .join(Todo, join_type=peewee.JOIN.LEFT_OUTER)
+                .switch(Event)
+                .join(EventType))
+
+    @classmethod
+    def older_query(cls, key, inclusive=False):
+        """Query of the events before key, newest first."""
+        query = cls.query()
+        if key is not None:
+            time, event_id = key
+            if inclusive:
+                same_time = Event.event_id <= event_id
+            else:
+                same_time = Event.event_id < event_id
+            # the redundant bound lets sqlite search the time index as a
+            # range instead of scanning it from the newest end
+            query = query.where((Event.time <= time)
+                                & ((Event.time < time)
+                                   | ((Event.time == time) & same_time)))
+
+        return query.order_by(Event.time.desc(), Event.event_id.desc())
+
+    @classmethod
+    def newer_query(cls, key):
+        """Query of the events after key, oldest first."""
+        time, event_id = key
+        return (cls.query()
+                .where((Event.time >= time)
+                       & ((Event.time > time)
+                          | ((Event.time == time)
+                             & (Event.event_id > event_id))))
+                .order_by(Event.time, Event.event_id))
+
+    def fetch_older(self, key, count, inclusive=False):
+        rows = list(self.older_query(key, inclusive).limit(count))
+        if len(rows) < count:
+            self.at_oldest = True
+        return rows
+
+    def fetch_newer(self, key, count):
+        if key is None:
+            self.at_newest = True
+            return []
+
+        rows = list(self.newer_query(key).limit(count))
+        if len(rows) < count:
+            self.at_newest = True
+        rows.reverse()
+        return rows
+
+    def load(self):
+        db.journal.flush()
+        prefetch = self.PREFETCH * self.PAGE_SIZE
+        newer = self.fetch_newer(self.anchor, prefetch)
+        older = self.fetch_older(self.anchor, self.PAGE_SIZE + prefetch,
+                                 inclusive=True)
+        self.rows = newer + older
+        self.offset = len(newer)
+
+    @property
+    def events(self):
+        if self.rows is None:
+            self.load()
+        return self.rows[self.offset:self.offset + self.PAGE_SIZE]
+
+    def set_offset(self, offset):
+        """Move the visible page and keep PREFETCH pages around it."""
+        prefetch = self.PREFETCH * self.PAGE_SIZE
+
+        missing = offset + self.PAGE_SIZE + prefetch - len(self.rows)
+        if missing > 0 and not self.at_oldest and self.rows:
+            self.rows.extend(self.fetch_older(self.key(self.rows[-1]),
+                                              missing))
+
+        if offset - prefetch < 0 and not self.at_newest and self.rows:
+            newer = self.fetch_newer(self.key(self.rows[0]),
+                                     prefetch - offset)
+            self.rows[:0] = newer
+            offset += len(newer)
+
+        offset = max(0, min(offset, len(self.rows) - self.PAGE_SIZE))
+
+        drop = offset - prefetch
+        if drop > 0:
+            del self.rows[:drop]
+            offset -= drop
+            self.at_newest = False
+
+        end = offset + self.PAGE_SIZE + prefetch
+        if end < len(self.rows):
+            del self.rows[end:]
+            self.at_oldest = False
+
+        self.offset = offset
+        if self.rows:
+            self.anchor = self.key(self.rows[offset])
+
+    def older(self):
+        if self.rows is None:
+            self.load()
+        self.set_offset(self.offset + self.PAGE_SIZE)
+
+    def newer(self):
+        if self.rows is None:
+            self.load()
+        self.set_offset(self.offset - self.PAGE_SIZE)
+        if self.offset == 0 and self.at_newest:
+            self.anchor = None
+
+    def jump_to(self, date):
+        """Show the newest events on or before the given date."""
+        self.anchor = (start_of_day(date + datetime.timedelta(days=1)), 0)
+        self.invalidate()
+        self.load()
+        if self.rows:
+            self.anchor = self.key(self.rows[self.offset])
@@ -0,0 +1,203 @@
+"""Counts the SQL statements, rows and time per frame and caller.
+
+The database of DatabaseManger is a MonitoredDatabase, which only records
+anything once a QueryMonitor is attached. The caller of a statement is the
+innermost dotrack function issuing it, prefixed by the innermost function
+outside of the model, usually the component property that needs the data,
+e.g. "EventList.events: EventHistory.fetch_older".
+"""
+
+import sys
+import threading
+import time
+
+import peewee
+
+MONITOR_MODULES = ('dotrack.querymonitor',)
+MODEL_MODULES = ('dotrack.model',)
+
+
+def frame_name(frame):
+    name = frame.f_code.co_name
+    local = frame.f_locals
+    if 'self' in local:
+        return f'{type(local["self"]).__name__}.{name}'
+    elif isinstance(local.get('cls'), type):
+        return f'{local["cls"].__name__}.{name}'
+    return name
+
+
+def find_caller():
+    inner = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('dotrack.') and module not in MONITOR_MODULES:
+            if inner is None:
+                inner = frame_name(frame)
+            if module not in MODEL_MODULES:
+                outer = frame_name(frame)
+                if outer == inner:
+                    return inner
+                return f'{outer}: {inner}'
+        frame = frame.f_back
+
+    return inner or 'unknown'
+
+
+class Stats:
+    __slots__ = ('statements', 'rows', 'seconds')
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.seconds = 0.
+
+    def add(self, other):
+        self.statements += other.statements
+        self.rows += other.rows
+        self.seconds += other.seconds
+
+    def as_dict(self):
+        return {
+            'statements': self.statements,
+            'rows': self.rows,
+            'seconds': self.seconds,
+        }
+
+
+class FrameStats(Stats):
+    __slots__ = ('callers',)
+
+    def __init__(self):
+        super().__init__()
+        self.callers = dict()
+
+    def caller(self, name):
+        try:
+            return self.callers[name]
+        except KeyError:
+            stats = self.callers[name] = Stats()
+            return stats
+
+    def add(self, other):
+        super().add(other)
+        for name, stats in other.callers.items():
+            self.caller(name).add(stats)
+
+    def top(self, count):
+        return sorted(self.callers.items(),
+                      key=lambda item: item[1].statements,
+                      reverse=True)[:count]
+
+
+class QueryMonitor:
+    """Aggregates the statements per frame and since the last dump."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame = FrameStats()
+        self.last_frame = FrameStats()
+        self.reset_totals()
+
+    def reset_totals(self):
+        self.totals = FrameStats()
+        self.frames = 0
+        self.max_statements = 0
+        self.over_budget = 0
+        self.started = time.time()
+
+    def record(self, caller, seconds=0., statements=0, rows=0):
+        with self.lock:
+            for stats in (self.frame, self.frame.caller(caller)):
+                stats.statements += statements
+                stats.rows += rows
+                stats.seconds += seconds
+
+    def begin_frame(self):
+        with self.lock:
+            self.frame = FrameStats()
+
+    def end_frame(self, budget=None):
+        """Finish the frame, returns its stats."""
+        with self.lock:
+            frame = self.frame
+            self.frame = FrameStats()
+
+        self.last_frame = frame
+        self.totals.add(frame)
+        self.frames += 1
+        self.max_statements = max(self.max_statements, frame.statements)
+        if budget is not None and frame.statements > budget:
+            self.over_budget += 1
+        return frame
+
+    def summary(self):
+        """Totals since the last reset, as JSON serializable dict."""
+        return {
+            'time': time.time(),
+            'duration': time.time() - self.started,
+            'frames': self.frames,
+            'frames_over_budget': self.over_budget,
+            'max_statements_per_frame': self.max_statements,
+            **self.totals.as_dict(),
+            'callers': {name: stats.as_dict()
+                        for name, stats in self.totals.top(
+                            len(self.totals.callers))},
+        }
+
+
+class CountingCursor:
+    """Cursor proxy counting the fetched rows."""
+
+    def __init__(self, cursor, monitor, caller):
+        self.cursor = cursor
+        self.monitor = monitor
+        self.caller = caller
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.monitor.record(self.caller, rows=1)
+            yield row
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.monitor.record(self.caller, rows=1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.cursor.fetchmany(*args)
+        self.monitor.record(self.caller, rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.monitor.record(self.caller, rows=len(rows))
+        return rows
+
+
+class MonitoredDatabase(peewee.SqliteDatabase):
+    """SqliteDatabase reporting its statements to the attached monitor.
+
+    The time is the time to execute the statement, fetching the rows is
+    not included.
+    """
+
+    monitor = None
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        monitor = self.monitor
+        if monitor is None:
+            return super().execute_sql(sql, params, *args, **kwargs)
+
+        caller = find_caller()
+        start = time.perf_counter()
+        try:
+            cursor = super().execute_sql(sql, params, *args, **kwargs)
+        finally:
+            monitor.record(caller, time.perf_counter() - start, statements=1)
+        return CountingCursor(cursor, monitor, caller)
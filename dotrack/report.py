@@ -0,0 +1,173 @@
+"""Work time reports computed in a single query.
+
+START and STOP events are paired with the LEAD() window function, with
+the same semantics as iter_sessions: a START lasts until the next START
+or STOP, a STOP without preceding START is ignored and the last START is
+still open. Sessions are clipped to the reported interval and split at
+midnight by a recursive CTE, then summed per day, week, todo or group.
+"""
+
+import datetime
+
+import peewee
+
+from dotrack.model import (db, Event, EventType, TaskGroup, Todo,
+                           start_of_day)
+from dotrack.transfer import format_value
+
+GROUPINGS = ('day', 'week', 'todo', 'group')
+
+
+def session_types():
+    return (EventType.START.event_type_id, EventType.STOP.event_type_id)
+
+
+def sessions(begin, end, now=None):
+    """CTEs (marks, sessions) of the sessions clipped to begin and end.
+
+    sessions has the columns todo_id, start and end.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+
+    # same format as stored by peewee, so that times compare as text
+    begin, end = format_value(begin), format_value(end)
+    now = format_value(now)
+
+    types = session_types()
+    Marks = Event.alias()
+    # the last mark before begin may start a session overlapping begin,
+    # the first one after end closes a session overlapping end
+    lower = (Marks
+             .select(peewee.fn.MAX(Marks.time))
+             .where(Marks.event_type.in_(types) & (Marks.time < begin)))
+    upper = (Marks
+             .select(peewee.fn.MIN(Marks.time))
+             .where(Marks.event_type.in_(types) & (Marks.time >= end)))
+
+    following = peewee.fn.LEAD(Event.time).over(
+        order_by=[Event.time, Event.event_id])
+
+    marks = (Event
+             .select(Event.todo, Event.event_type, Event.time,
+                     following.alias('next'))
+             .where(Event.event_type.in_(types)
+                    & (Event.time >= peewee.fn.COALESCE(lower, begin))
+                    & (Event.time <= peewee.fn.COALESCE(upper, end)))
+             .cte('marks'))
+
+    start = EventType.START.event_type_id
+    session_end = peewee.fn.COALESCE(marks.c.next, now)
+    sessions = (peewee
+                .Select([marks], [
+                    marks.c.todo_id,
+                    peewee.fn.MAX(marks.c.time, begin).alias('start'),
+                    peewee.fn.MIN(session_end, end).alias('end')])
+                .where((marks.c.event_type_id == start)
+                       & (marks.c.time < end)
+                       & (session_end > begin))
+                .cte('sessions'))
+
+    return marks, sessions
+
+
+def pieces(sessions):
+    """Recursive CTE splitting sessions at midnight.
+
+    Columns are todo_id, start, stop and end, where start to stop is the
+    piece and end the end of the whole session.
+    """
+    def midnight(time):
+        return peewee.fn.datetime(time, 'start of day', '+1 day')
+
+    base = (peewee
+            .Select([sessions], [
+                sessions.c.todo_id,
+                sessions.c.start,
+                peewee.fn.MIN(sessions.c.end, midnight(sessions.c.start)),
+                sessions.c.end])
+            .where(sessions.c.start < sessions.c.end)
+            .cte('pieces', recursive=True,
+                 columns=('todo_id', 'start', 'stop', 'end')))
+
+    recursive = (peewee
+                 .Select([base], [
+                     base.c.todo_id,
+                     base.c.stop,
+                     peewee.fn.MIN(base.c.end, midnight(base.c.stop)),
+                     base.c.end])
+                 .where(base.c.stop < base.c.end))
+
+    return base.union_all(recursive)
+
+
+def work_time(begin, end, by='day', now=None):
+    """Query of (key, seconds) for the work time between begin and end.
+
+    The key is the date for day, the monday for week, the todo text for
+    todo and the task group name for group.
+    """
+    if by not in GROUPINGS:
+        raise ValueError(f'Unknown grouping {by}.')
+
+    marks, sessions_cte = sessions(begin, end, now)
+    pieces_cte = pieces(sessions_cte)
+
+    seconds = peewee.fn.SUM(
+        (peewee.fn.julianday(pieces_cte.c.stop)
+         - peewee.fn.julianday(pieces_cte.c.start)) * 86400)
+
+    query = peewee.Select([pieces_cte]).with_cte(
+        marks, sessions_cte, pieces_cte)
+
+    if by == 'day':
+        key = peewee.fn.date(pieces_cte.c.start)
+    elif by == 'week':
+        key = peewee.fn.date(pieces_cte.c.start, 'weekday 0', '-6 days')
+    elif by == 'todo':
+        key = Todo.text
+        query = query.join(
+            Todo, on=(Todo.todo_id == pieces_cte.c.todo_id))
+    else:
+        key = TaskGroup.name
+        query = (query
+                 .join(Todo, on=(Todo.todo_id == pieces_cte.c.todo_id))
+                 .join(TaskGroup, on=(TaskGroup.task_group_id
+                                      == Todo.group)))
+
+    if by in ('todo', 'group'):
+        group_by = [key, Todo.todo_id] if by == 'todo' else [key]
+        order_by = [seconds.desc()]
+    else:
+        group_by = [key]
+        order_by = [key]
+
+    return (query
+            .select(key.alias('key'), seconds.alias('seconds'))
+            .group_by(*group_by)
+            .order_by(*order_by)
+            .bind(db()))
+
+
+def format_duration(seconds):
+    minutes = round(seconds / 60)
+    return f'{minutes // 60}:{minutes % 60:02}'
+
+
+def print_report(begin, end, by='day'):
+    """Print the work time from the begin date up to and including end."""
+    db.connect()
+    try:
+        query = work_time(
+            start_of_day(begin),
+            start_of_day(end + datetime.timedelta(days=1)),
+            by)
+
+        total = 0
+        for key, seconds in query.tuples():
+            total += seconds
+            print(f'{format_duration(seconds):>7}  {key}')
+
+        print(f'{format_duration(total):>7}  total')
+    finally:
+        db.close()
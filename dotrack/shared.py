@@ -1,7 +1,6 @@
 from pathlib import Path
 from guiml.resources import ResourceManager
 from guiml.components import component as guiml_component
-from dotrack import icon  # noqa: F401
 
 BASE_DIR = Path(__file__).parent.resolve()
 DATA_DIR = BASE_DIR / "../data"
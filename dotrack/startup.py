@@ -0,0 +1,139 @@
+import functools
+import importlib.abc
+import sys
+import time
+
+from contextlib import contextmanager
+
+
+class TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, name, trace):
+        self.loader = loader
+        self.name = name
+        self.trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self.trace.span(f'import {self.name}'):
+            self.loader.exec_module(module)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Meta path finder that wraps loaders to record the import time."""
+
+    def __init__(self, trace, packages):
+        self.trace = trace
+        self.packages = packages
+
+    def is_traced(self, name):
+        package, _, submodule = name.partition('.')
+        return (package == 'dotrack'
+                or (package in self.packages and not submodule))
+
+    def find_spec(self, name, path, target=None):
+        if not self.is_traced(name):
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None \
+                        and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimedLoader(spec.loader, name, self.trace)
+                return spec
+
+        return None
+
+
+class StartupTrace:
+    """Records where the time until the first frame is spent.
+
+    Spans are always recorded, as this is cheap, but only reported if
+    enabled, see the --trace-startup option. Work that is not needed for
+    the first frame can be deferred with after_first_frame.
+    """
+
+    PACKAGES = ('guiml', 'guimlcomponents', 'pyglet', 'peewee', 'cairocffi',
+                'pangocffi', 'pangocairocffi', 'yaml')
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.enabled = False
+        self.records = list()
+        self.depth = 0
+        self.first_frame = False
+        self.deferred = list()
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    def watch_imports(self):
+        sys.meta_path.insert(0, ImportTimer(self, self.PACKAGES))
+
+    @contextmanager
+    def span(self, name):
+        record = [name, self.now(), None, self.depth]
+        self.records.append(record)
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            record[2] = self.now() - record[1]
+
+    def timed(self, fn):
+        """Decorator recording a span for every call before the first
+        frame."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if self.first_frame:
+                return fn(*args, **kwargs)
+
+            with self.span(fn.__qualname__):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def after_first_frame(self, callback):
+        if self.first_frame:
+            callback()
+        else:
+            self.deferred.append(callback)
+
+    def on_first_frame(self):
+        if self.first_frame:
+            return
+
+        self.records.append(['first frame', self.now(), None, 0])
+        self.first_frame = True
+
+        if self.enabled:
+            self.report()
+
+        deferred = self.deferred
+        self.deferred = list()
+        for callback in deferred:
+            with self.span(getattr(callback, '__qualname__', 'deferred')):
+                callback()
+
+    def report(self, file=None):
+        if file is None:
+            file = sys.stderr
+
+        print('startup trace (ms, since dotrack was imported):', file=file)
+        print(f'{"start":>8} {"duration":>8}', file=file)
+        for name, start, duration, depth in self.records:
+            duration = '' if duration is None else f'{duration * 1000:.1f}'
+            print(f'{start * 1000:8.1f} {duration:>8} {"  " * depth}{name}',
+                  file=file)
+
+
+startup = StartupTrace()
@@ -11,6 +11,16 @@ from dotrack.shared import component
 from dotrack.model import Timer
 
 
+def format_remaining(remaining):
+    if remaining < 0:
+        sign = True
+        remaining = -remaining
+    else:
+        sign = False
+
+    return f'{"-" if sign else " "}{remaining//60:02}:{ remaining % 60:02}'
+
+
 @component("timer")
 class TimerComponent(Container):
     @dataclass
@@ -31,17 +41,17 @@ class TimerComponent(Container):
 
     @property
     def remaining_str(self):
+        # the text only changes once per second
         remaining = int(round(self.remaining))
-        if remaining < 0:
-            sign = True
-            remaining = -remaining
-        else:
-            sign = False
-
-        return f'{"-" if sign else " "}{remaining//60:02}:{ remaining % 60:02}'
+        if remaining != self._remaining:
+            self._remaining = remaining
+            self._remaining_str = format_remaining(remaining)
+        return self._remaining_str
 
     def on_init(self):
         super().on_init()
+        self._remaining = None
+        self._remaining_str = None
 
     def on_destroy(self):
         super().on_destroy()
@@ -70,6 +80,11 @@ class CircleProgress(UIComponent):
         height: int = 150
         progress: float = 0
 
+    def on_init(self):
+        super().on_init()
+        self.surface = None
+        self.surface_key = None
+
     @property
     def width(self):
         return self.properties.width
@@ -78,17 +93,45 @@ class CircleProgress(UIComponent):
     def height(self):
         return self.properties.height
 
-    def on_draw(self, ctx):
-        center_x = self.properties.position.left + self.width // 2
-        center_y = self.properties.position.top + self.height // 2
+    def render(self, step, steps):
+        if self.surface is None or self.surface_key[:2] != (self.width,
+                                                            self.height):
+            self.surface = cairo.ImageSurface(
+                cairo.FORMAT_ARGB32, self.width, self.height)
+
+        center_x = self.width // 2
+        center_y = self.height // 2
         radius = min(self.width, self.height) // 2
-        progress = self.properties.progress
 
-        with ctx:
+        ctx = cairo.Context(self.surface)
+        ctx.set_operator(cairo.OPERATOR_CLEAR)
+        ctx.paint()
+        ctx.set_operator(cairo.OPERATOR_OVER)
+
+        if step > 0:
             ctx.move_to(center_x, center_y)
-            ctx.arc(center_x, center_y, radius, -math.pi/2, -math.pi/2 + 2 * math.pi * progress)
-            pat = cairo.SolidPattern(0, 0.8, 0, 1)
-            ctx.set_source(pat)
+            ctx.arc(center_x, center_y, radius, -math.pi/2,
+                    -math.pi/2 + 2 * math.pi * step / steps)
+            ctx.set_source_rgba(0, 0.8, 0, 1)
             ctx.fill()
 
-        super().on_draw(ctx)
\ No newline at end of file
+    def on_draw(self, ctx):
+        if self.width > 0 and self.height > 0:
+            # quantize progress, so that the arc is only redrawn when its end
+            # moves by at least a device pixel
+            radius = min(self.width, self.height) // 2
+            steps = max(1, math.ceil(2 * math.pi * radius))
+            step = round(self.properties.progress * steps)
+
+            key = (self.width, self.height, step)
+            if key != self.surface_key:
+                self.render(step, steps)
+                self.surface_key = key
+
+            with ctx:
+                ctx.set_source_surface(self.surface,
+                                       self.properties.position.left,
+                                       self.properties.position.top)
+                ctx.paint()
+
+        super().on_draw(ctx)
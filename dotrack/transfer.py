@@ -0,0 +1,292 @@
+"""Streaming export and import of the database.
+
+Records are written as JSON lines, one object per row with the table in
+the "table" key, or as CSV with one file per table in a directory. Rows
+are streamed from the database with server side cursors and imported in
+batches, so neither needs the full history in memory.
+
+Todos keep their ids on export; on import they are shifted past the
+largest existing todo id, so that an export can be merged into an
+existing database. Task groups and event / exp types are referenced by
+name and resolved against the target database.
+"""
+
+import csv
+import datetime
+import functools
+import json
+import sys
+
+from pathlib import Path
+
+import peewee
+
+from dotrack.model import (db, name_registry, TaskGroup, Todo, EventType,
+                           Event, ExpType, ExpEvent, ExpLedger, WorkSession)
+
+TABLES = {
+    'task_group': ('name',),
+    'event_type': ('name',),
+    'exp_type': ('name',),
+    'todo': ('todo_id', 'text', 'done', 'deleted', 'group'),
+    'event': ('todo', 'type', 'time'),
+    'exp_event': ('todo', 'type', 'exp', 'time'),
+}
+"""Exported tables and their fields, in the order they are written."""
+
+BATCH_SIZE = 1000
+
+
+def export_queries():
+    """Yield (table, query) with queries returning rows in TABLES order."""
+    for table, model in (('task_group', TaskGroup),
+                         ('event_type', EventType),
+                         ('exp_type', ExpType)):
+        yield table, (model
+                      .select(model.name)
+                      .order_by(model._meta.primary_key))
+
+    yield 'todo', (Todo
+                   .select(Todo.todo_id, Todo.text, Todo.done, Todo.deleted,
+                           TaskGroup.name)
+                   .join(TaskGroup)
+                   .order_by(Todo.todo_id))
+
+    yield 'event', (Event
+                    .select(Event.todo, EventType.name, Event.time)
+                    .join(EventType)
+                    .order_by(Event.event_id))
+
+    yield 'exp_event', (ExpEvent
+                        .select(ExpEvent.todo, ExpType.name, ExpEvent.exp,
+                                ExpEvent.time)
+                        .join(ExpType)
+                        .order_by(ExpEvent.exp_event_id))
+
+
+def format_value(value):
+    if isinstance(value, datetime.datetime):
+        # same format as stored by peewee
+        return str(value)
+    return value
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        if self.path == '-':
+            self.file = sys.stdout
+        else:
+            self.file = open(self.path, 'w', encoding='utf-8')
+        return self
+
+    def __exit__(self, *args):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+    def write(self, table, rows):
+        fields = TABLES[table]
+        for row in rows:
+            record = {'table': table}
+            for key, value in zip(fields, row):
+                record[key] = format_value(value)
+            self.file.write(json.dumps(record, ensure_ascii=False))
+            self.file.write('\n')
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __enter__(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def write(self, table, rows):
+        fields = TABLES[table]
+        with open(self.path / f'{table}.csv', 'w', newline='',
+                  encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(
+                    '' if value is None else format_value(value)
+                    for value in row)
+
+
+def read_jsonl(path):
+    """Yield (table, record) from a JSON lines export."""
+    if path == '-':
+        lines = sys.stdin
+    else:
+        lines = open(path, 'r', encoding='utf-8')
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            table = record.pop('table', None)
+            if table not in TABLES:
+                raise ValueError(
+                    f'{path}:{number}: unknown table {table!r}')
+            yield table, record
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+def read_csv(path):
+    """Yield (table, record) from a CSV export directory."""
+    path = Path(path)
+    for table in TABLES:
+        file_path = path / f'{table}.csv'
+        if not file_path.exists():
+            continue
+
+        with open(file_path, 'r', newline='', encoding='utf-8') as f:
+            for record in csv.DictReader(f):
+                yield table, {key: (None if value == '' else value)
+                              for key, value in record.items()}
+
+
+def parse_time(value):
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true')
+    return bool(value)
+
+
+def parse_id(value, offset=0):
+    if value is None:
+        return None
+    return int(value) + offset
+
+
+class Importer:
+    def __init__(self):
+        self.groups = functools.partial(name_registry.get_id, TaskGroup)
+        self.event_types = functools.partial(name_registry.get_id, EventType)
+        self.exp_types = functools.partial(name_registry.get_id, ExpType)
+        self.todo_offset = Todo.select(
+            peewee.fn.MAX(Todo.todo_id)).scalar() or 0
+        self.counts = {table: 0 for table in TABLES}
+
+        self.converters = {
+            'task_group': self.task_group,
+            'event_type': self.event_type,
+            'exp_type': self.exp_type,
+            'todo': self.todo,
+            'event': self.event,
+            'exp_event': self.exp_event,
+        }
+
+    def task_group(self, record):
+        self.groups(record['name'])
+
+    def event_type(self, record):
+        self.event_types(record['name'])
+
+    def exp_type(self, record):
+        self.exp_types(record['name'])
+
+    def todo(self, record):
+        return (parse_id(record['todo_id'], self.todo_offset),
+                record['text'],
+                parse_time(record.get('done')),
+                parse_bool(record.get('deleted', False)),
+                self.groups(record['group']))
+
+    def event(self, record):
+        return (parse_id(record.get('todo'), self.todo_offset),
+                self.event_types(record['type']),
+                parse_time(record['time']))
+
+    def exp_event(self, record):
+        return (parse_id(record.get('todo'), self.todo_offset),
+                self.exp_types(record['type']),
+                int(record['exp']),
+                parse_time(record['time']))
+
+    def flush(self, table, rows):
+        if not rows:
+            return
+
+        if table == 'todo':
+            query = Todo.insert_many(
+                rows, fields=[Todo.todo_id, Todo.text, Todo.done,
+                              Todo.deleted, Todo.group])
+        elif table == 'event':
+            query = Event.insert_many(
+                rows, fields=[Event.todo, Event.event_type, Event.time])
+        else:
+            query = ExpEvent.insert_many(
+                rows, fields=[ExpEvent.todo, ExpEvent.event_type,
+                              ExpEvent.exp, ExpEvent.time])
+
+        query.execute()
+        self.counts[table] += len(rows)
+
+    def run(self, records):
+        """Insert all records and rebuild the derived tables in a single
+        transaction."""
+        table = None
+        rows = list()
+        with db().atomic():
+            for record_table, record in records:
+                if record_table != table or len(rows) >= BATCH_SIZE:
+                    self.flush(table, rows)
+                    table = record_table
+                    rows = list()
+
+                row = self.converters[table](record)
+                if row is not None:
+                    rows.append(row)
+                else:
+                    self.counts[table] += 1
+
+            self.flush(table, rows)
+
+            if self.counts['event']:
+                WorkSession.rebuild()
+            if self.counts['exp_event']:
+                ExpLedger.rebuild()
+
+        return self.counts
+
+
+def export_db(path, format='jsonl'):
+    writer = CsvWriter(path) if format == 'csv' else JsonlWriter(path)
+
+    db.connect()
+    try:
+        with writer:
+            for table, query in export_queries():
+                writer.write(table, query.tuples().iterator())
+    finally:
+        db.close()
+
+
+def import_db(path, format='jsonl'):
+    records = read_csv(path) if format == 'csv' else read_jsonl(path)
+
+    db.connect()
+    try:
+        counts = Importer().run(records)
+    finally:
+        db.close()
+
+    for table, count in counts.items():
+        print(f'imported {count} {table} rows', file=sys.stderr)
@@ -0,0 +1,19 @@
+"""Every tag's injectables have to resolve on their own.
+
+guiml resolves the injectables of a tag without looking at other tags,
+a dependency on an injectable of another tag fails when the tag is
+added.
+"""
+
+import pytest
+
+from guiml.injectables import DependencyResolver
+from guiml.registry import _injectables
+
+import dotrack.app  # noqa: F401, registers the injectables
+
+
+@pytest.mark.parametrize('tag', sorted(_injectables))
+def test_tag_resolves(tag):
+    assert len(list(DependencyResolver(_injectables[tag]))) \
+        == len(_injectables[tag])
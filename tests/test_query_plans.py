@@ -0,0 +1,73 @@
+"""The hot queries have to be answered from the indexes.
+
+Checked with EXPLAIN QUERY PLAN on a freshly evolved database, a SCAN of
+a table or index means the query gets slower with the size of the
+history.
+"""
+
+import datetime
+import re
+
+import pytest
+
+from dotrack import report
+from dotrack.model import db, EventHistory, ExpEvent, TodoService
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'SAVE_FILE', tmp_path / 'dotrack.db')
+    db.connect()
+    yield db()
+    db.close()
+
+
+def query_plan(database, query):
+    sql, params = query.sql()
+    cursor = database.execute_sql(f'EXPLAIN QUERY PLAN {sql}', params)
+    return [row[3] for row in cursor.fetchall()]
+
+
+# tables are aliased t1, t2, ... in selects, scans of CTEs are fine
+TABLE_SCAN = re.compile(r'SCAN (t\d+|todo|event|expevent)\b')
+
+
+def assert_search(plan, index):
+    assert any(step.startswith('SEARCH') and index in step
+               for step in plan), plan
+    assert not any(TABLE_SCAN.match(step) for step in plan), plan
+
+
+NOW = datetime.datetime(2024, 5, 17, 12, 30)
+
+
+def test_visible_todos(database):
+    query = TodoService.visible_todos(1, NOW)
+    assert_search(query_plan(database, query), 'todo_group_id_deleted_done')
+
+
+def test_work_time_event_range(database):
+    query = report.work_time(NOW - datetime.timedelta(days=7), NOW)
+    assert_search(query_plan(database, query), 'event_time_event_type_id')
+
+
+def test_exp_event_untoggle_delete(database):
+    query = (ExpEvent
+             .delete()
+             .where(ExpEvent.todo == 1)
+             .where(ExpEvent.event_type == 1))
+    assert_search(query_plan(database, query),
+                  'expevent_todo_id_event_type_id')
+
+
+@pytest.mark.parametrize('inclusive', [False, True])
+def test_event_list_older_page(database, inclusive):
+    query = EventHistory.older_query((NOW, 10), inclusive).limit(15)
+    plan = query_plan(database, query)
+    assert_search(plan, 'event_time_event_type_id (time<?)')
+
+
+def test_event_list_newer_page(database):
+    query = EventHistory.newer_query((NOW, 10)).limit(15)
+    plan = query_plan(database, query)
+    assert_search(plan, 'event_time_event_type_id (time>?)')